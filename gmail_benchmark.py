@@ -0,0 +1,477 @@
+"""
+Offline benchmark for GmailService.
+Runs the service's hot paths against a local stand-in for the Gmail REST API, with
+configurable latency and error injection, and reports throughput, latency percentiles
+and Gmail requests per operation. No Google account or network access is needed.
+
+    python gmail_benchmark.py --sizes 100,1000 --concurrency 1,8,32 --latency-ms 20
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Callable
+from urllib.parse import parse_qs, urlparse
+
+from gmail_mcp_server import GMAIL_QUOTA_UNITS_PER_SECOND, GmailService
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ['list', 'unread', 'read', 'trash', 'mark-read', 'send']
+RATE_LIMIT_ERROR = {'error': {'code': 429, 'message': 'Rate Limit Exceeded',
+                              'errors': [{'reason': 'rateLimitExceeded'}]}}
+
+def b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode()
+
+class FakeMailbox:
+    """In-memory mailbox with Gmail's message, label and history bookkeeping"""
+
+    def __init__(self, size: int = 0):
+        self.lock = threading.Lock()
+        self.messages: dict[str, dict[str, Any]] = {}
+        self.order: list[str] = []
+        self.history: list[dict[str, Any]] = []
+        self.history_id = 1000
+        self.sent: list[bytes] = []
+        self.uploads: dict[str, bytearray] = {}
+        for i in range(size):
+            self.add_message(f"sender{i}@example.com", f"Subject {i}", f"Body of message {i}\n" * 20)
+
+    def _next_history(self) -> str:
+        self.history_id += 1
+        return str(self.history_id)
+
+    def add_message(self, sender: str, subject: str, body: str,
+                    labels: tuple[str, ...] = ('INBOX', 'UNREAD', 'CATEGORY_PERSONAL')) -> str:
+        message = EmailMessage()
+        message['From'] = sender
+        message['To'] = 'me@example.com'
+        message['Subject'] = subject
+        message['Date'] = 'Mon, 1 Jan 2024 00:00:00 +0000'
+        message.set_content(body)
+        with self.lock:
+            message_id = f"m{len(self.messages):06d}"
+            self.messages[message_id] = {'id': message_id, 'threadId': f"t{message_id}",
+                                         'labelIds': list(labels), 'raw': message.as_bytes(),
+                                         'historyId': self._next_history(), 'snippet': body[:100]}
+            self.order.insert(0, message_id)
+            self.history.append({'id': str(self.history_id),
+                                 'messagesAdded': [{'message': self.ref(message_id)}]})
+        return message_id
+
+    def ref(self, message_id: str) -> dict[str, Any]:
+        message = self.messages[message_id]
+        return {'id': message_id, 'threadId': message['threadId'], 'labelIds': list(message['labelIds'])}
+
+    def modify(self, message_id: str, add: list[str], remove: list[str]) -> None:
+        """Change labels and record the history entries Gmail would. Caller holds the lock."""
+        message = self.messages[message_id]
+        added = [label for label in add if label not in message['labelIds']]
+        removed = [label for label in remove if label in message['labelIds']]
+        message['labelIds'] = [label for label in message['labelIds'] if label not in removed] + added
+        message['historyId'] = self._next_history()
+        record = {'id': message['historyId']}
+        if added:
+            record['labelsAdded'] = [{'message': self.ref(message_id), 'labelIds': added}]
+        if removed:
+            record['labelsRemoved'] = [{'message': self.ref(message_id), 'labelIds': removed}]
+        self.history.append(record)
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    """Serves the subset of the Gmail REST API that GmailService uses, including batch requests"""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, Nagle would hold the body for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+    def do_PUT(self) -> None:
+        self._handle('PUT')
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server.count('http_requests')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.path.startswith('/batch'):
+            return self._batch(body)
+        if self.server.inject_error():
+            return self._send(429, RATE_LIMIT_ERROR, {'Retry-After': '0'})
+        status, payload, headers = self.route(method, self.path, body, dict(self.headers))
+        self._send(status, payload, headers)
+
+    def _send(self, status: int, payload: Any, headers: dict[str, str] | None = None) -> None:
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        headers = dict(headers or {})
+        self.send_response(status)
+        self.send_header('Content-Type', headers.pop('Content-Type', 'application/json'))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _batch(self, body: bytes) -> None:
+        """Answers a multipart/mixed batch, routing every part like a standalone request"""
+        request = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+        boundary = 'batch_response'
+        parts = []
+        for part in request.iter_parts():
+            inner = part.get_payload(decode=True) or part.get_payload().encode()
+            head, _, inner_body = inner.partition(b'\r\n\r\n')
+            method, path, _ = head.split(b'\r\n')[0].decode().split(' ', 2)
+            if self.server.inject_error():
+                status, payload = 429, RATE_LIMIT_ERROR
+            else:
+                status, payload, _ = self.route(method, path, inner_body, {})
+            data = json.dumps(payload) if payload != b'' else ''
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                         f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                         f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\n\r\n{data}\r\n")
+        parts.append(f"--{boundary}--\r\n")
+        self._send(200, ''.join(parts).encode(),
+                   {'Content-Type': f"multipart/mixed; boundary={boundary}"})
+
+    def route(self, method: str, path: str, body: bytes,
+              headers: dict[str, str]) -> tuple[int, Any, dict[str, str]]:
+        """Handles one API call and returns (status, JSON payload or bytes, response headers)"""
+        self.server.count('api_calls')
+        box = self.server.mailbox
+        url = urlparse(path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        path = url.path
+        not_found = (404, {'error': {'code': 404, 'message': 'Not Found'}}, {})
+        with box.lock:
+            if path.endswith('/users/me/profile'):
+                return 200, {'emailAddress': 'me@example.com', 'historyId': str(box.history_id),
+                             'messagesTotal': len(box.messages)}, {}
+            if path.endswith('/users/me/history'):
+                start = int(query['startHistoryId'])
+                records = [record for record in box.history if int(record['id']) > start]
+                return 200, {'history': records, 'historyId': str(box.history_id)}, {}
+            if re.search(r'/users/me/messages/[^/]+/attachments/[^/]+$', path):
+                return 200, {'size': 10, 'data': b64(b'attachment')}, {}
+            match = re.search(r'/users/me/threads/([^/]+)$', path)
+            if match:
+                messages = [self._full(message_id) for message_id in reversed(box.order)
+                            if box.messages[message_id]['threadId'] == match.group(1)]
+                return (200, {'id': match.group(1), 'messages': messages}, {}) if messages else not_found
+            if path.endswith('/users/me/messages/batchModify'):
+                request = json.loads(body)
+                for message_id in request['ids']:
+                    if message_id in box.messages:
+                        box.modify(message_id, request.get('addLabelIds', []), request.get('removeLabelIds', []))
+                return 204, b'', {}
+            if path.startswith('/upload/') and path.endswith('/messages/send'):
+                return self._upload(query, body, headers)
+            if path.endswith('/users/me/messages/send'):
+                box.sent.append(base64.urlsafe_b64decode(json.loads(body)['raw']))
+                return 200, {'id': f"s{len(box.sent)}", 'threadId': 'tsent', 'labelIds': ['SENT']}, {}
+            match = re.search(r'/users/me/messages/([^/]+)/(trash|modify)$', path)
+            if match:
+                message_id, action = match.groups()
+                if message_id not in box.messages:
+                    return not_found
+                if action == 'trash':
+                    box.modify(message_id, ['TRASH'], ['INBOX'])
+                else:
+                    request = json.loads(body)
+                    box.modify(message_id, request.get('addLabelIds', []), request.get('removeLabelIds', []))
+                return 200, box.ref(message_id), {}
+            match = re.search(r'/users/me/messages/([^/]+)$', path)
+            if match and method == 'GET':
+                message_id = match.group(1)
+                if message_id not in box.messages:
+                    return not_found
+                message = box.messages[message_id]
+                if query.get('format') == 'raw':
+                    return 200, {'id': message_id, 'threadId': message['threadId'],
+                                 'labelIds': message['labelIds'], 'historyId': message['historyId'],
+                                 'snippet': message['snippet'], 'raw': b64(message['raw'])}, {}
+                return 200, self._full(message_id, metadata=query.get('format') == 'metadata'), {}
+            if path.endswith('/users/me/messages'):
+                unread_only = 'is:unread' in query.get('q', '')
+                ids = [message_id for message_id in box.order
+                       if not unread_only or {'INBOX', 'UNREAD'} <= set(box.messages[message_id]['labelIds'])]
+                size = int(query.get('maxResults', 100))
+                start = int(query.get('pageToken', 0))
+                response = {'resultSizeEstimate': len(ids)}
+                if ids[start:start + size]:
+                    response['messages'] = [{'id': message_id, 'threadId': box.messages[message_id]['threadId']}
+                                            for message_id in ids[start:start + size]]
+                if start + size < len(ids):
+                    response['nextPageToken'] = str(start + size)
+                return 200, response, {}
+        return 404, {'error': {'code': 404, 'message': f"No route for {method} {path}"}}, {}
+
+    def _full(self, message_id: str, metadata: bool = False) -> dict[str, Any]:
+        """Message resource in format=full, or format=metadata with top-level headers only"""
+        message = self.server.mailbox.messages[message_id]
+
+        def part_resource(part, part_id: str) -> dict[str, Any]:
+            resource = {'partId': part_id, 'mimeType': part.get_content_type(),
+                        'filename': part.get_filename() or '',
+                        'headers': [{'name': name, 'value': value} for name, value in part.items()]}
+            if part.is_multipart():
+                resource['body'] = {'size': 0}
+                resource['parts'] = [part_resource(sub_part, f"{part_id}.{i}" if part_id else str(i))
+                                     for i, sub_part in enumerate(part.get_payload())]
+            else:
+                data = part.get_payload(decode=True) or b''
+                resource['body'] = {'size': len(data), 'data': b64(data)}
+            return resource
+
+        payload = part_resource(message_from_bytes(message['raw']), '')
+        if metadata:
+            payload = {'mimeType': payload['mimeType'], 'headers': payload['headers']}
+        return {'id': message_id, 'threadId': message['threadId'], 'labelIds': message['labelIds'],
+                'historyId': message['historyId'], 'snippet': message['snippet'],
+                'sizeEstimate': len(message['raw']), 'payload': payload}
+
+    def _upload(self, query: dict[str, str], body: bytes,
+                headers: dict[str, str]) -> tuple[int, Any, dict[str, str]]:
+        """Media upload for messages.send, simple or resumable"""
+        box = self.server.mailbox
+        if query.get('uploadType') != 'resumable':
+            box.sent.append(body)
+            return 200, {'id': f"s{len(box.sent)}", 'threadId': 'tsent', 'labelIds': ['SENT']}, {}
+        if 'upload_id' not in query:
+            upload_id = str(len(box.uploads))
+            box.uploads[upload_id] = bytearray()
+            host, port = self.server.server_address[:2]
+            location = (f"http://{host}:{port}/upload/gmail/v1/users/me/messages/send"
+                        f"?uploadType=resumable&upload_id={upload_id}")
+            return 200, b'', {'Location': location}
+        received = box.uploads[query['upload_id']]
+        content_range = {name.lower(): value for name, value in headers.items()}.get('content-range', '')
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        if match:
+            first, _, total = match.groups()
+            if int(first) == len(received):
+                received.extend(body)
+            if total != '*' and len(received) == int(total):
+                box.sent.append(bytes(received))
+                return 200, {'id': f"s{len(box.sent)}", 'threadId': 'tsent', 'labelIds': ['SENT']}, {}
+        return 308, b'', {'Range': f"bytes=0-{len(received) - 1}"}
+
+class FakeGmailServer(ThreadingHTTPServer):
+    """Local Gmail stand-in. latency is added to every HTTP request, error_rate is the chance
+    of a 429 rateLimitExceeded for each call, including each part of a batch."""
+    daemon_threads = True
+
+    def __init__(self, mailbox: FakeMailbox, latency: float = 0.0, error_rate: float = 0.0):
+        super().__init__(('127.0.0.1', 0), FakeGmailHandler)
+        self.mailbox = mailbox
+        self.latency = latency
+        self.error_rate = error_rate
+        self.counters = {'http_requests': 0, 'api_calls': 0}
+        self._counter_lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def root_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count(self, counter: str) -> None:
+        with self._counter_lock:
+            self.counters[counter] += 1
+
+    def inject_error(self) -> bool:
+        return bool(self.error_rate) and random.random() < self.error_rate
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def is_error(result: Any) -> bool:
+    """GmailService reports failures as 'An HttpError occurred' strings or error status dicts"""
+    if isinstance(result, str):
+        return result.startswith('An HttpError occurred')
+    return isinstance(result, dict) and result.get('status') == 'error'
+
+def operation(service: GmailService, mailbox: FakeMailbox, name: str,
+              message_ids: list[str]) -> Callable[[int], Awaitable[Any]]:
+    """Coroutine factory for one benchmarked operation, called with the operation's index"""
+
+    async def list_page(i: int) -> Any:
+        page = await service.get_unread_emails_page(50)
+        if isinstance(page, str):
+            return page
+        return await service.get_email_summaries([message['id'] for message in page['messages']])
+
+    async def sync_unread(i: int) -> Any:
+        # A new email each time, so every call applies history records instead of finding none
+        mailbox.add_message(f"new{i}@example.com", f"New {i}", 'Hello\n' * 20)
+        return await service.get_unread_emails()
+
+    # Each call touches a different message, so reads measure downloads until the mailbox wraps
+    operations = {
+        'list': list_page,
+        'unread': sync_unread,
+        'read': lambda i: service.read_email(message_ids[i % len(message_ids)]),
+        'trash': lambda i: service.trash_email(message_ids[i % len(message_ids)]),
+        'mark-read': lambda i: service.mark_email_as_read(message_ids[i % len(message_ids)]),
+        'send': lambda i: service.send_email('someone@example.com', f"Benchmark {i}", 'Hello\n' * 50),
+    }
+    return operations[name]
+
+async def run_case(name: str, size: int, concurrency: int, count: int, latency: float,
+                   error_rate: float, quota_units_per_second: float) -> dict[str, Any]:
+    """Runs count operations with concurrency workers against a fresh mailbox of size messages"""
+    mailbox = FakeMailbox(size)
+    server = FakeGmailServer(mailbox, latency, error_rate)
+    # The server's cache, sync state and token go away with the case
+    with tempfile.TemporaryDirectory(prefix='gmail_benchmark_') as state_dir:
+        token_path = os.path.join(state_dir, 'token.json')
+        with open(token_path, 'w') as token_file:
+            json.dump({'token': 'benchmark', 'refresh_token': 'benchmark', 'client_id': 'benchmark',
+                       'client_secret': 'benchmark', 'expiry': '2999-01-01T00:00:00Z'}, token_file)
+        service = GmailService(os.path.join(state_dir, 'credentials.json'), token_path,
+                               quota_units_per_second=quota_units_per_second, api_root_url=server.root_url)
+        try:
+            service.start()
+            await service.wait_ready()
+            run = operation(service, mailbox, name, list(reversed(mailbox.order)))
+            baseline = dict(server.counters)
+            indexes = iter(range(count))
+            latencies = []
+            errors = 0
+
+            async def worker() -> None:
+                nonlocal errors
+                for i in indexes:
+                    start = time.perf_counter()
+                    result = await run(i)
+                    latencies.append(time.perf_counter() - start)
+                    errors += is_error(result)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+        finally:
+            # Closing flushes deferred work such as queued mark-read calls, which belongs to the run
+            await service.close()
+            server.shutdown()
+            server.server_close()
+
+    latencies.sort()
+    return {
+        'operation': name,
+        'mailbox_size': size,
+        'concurrency': concurrency,
+        'operations': count,
+        'errors': errors,
+        'ops_per_second': count / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'http_requests_per_op': (server.counters['http_requests'] - baseline['http_requests']) / count,
+        'api_calls_per_op': (server.counters['api_calls'] - baseline['api_calls']) / count,
+    }
+
+def print_results(results: list[dict[str, Any]]) -> None:
+    columns = [('operation', 'operation', '{}'), ('mailbox_size', 'size', '{}'),
+               ('concurrency', 'conc', '{}'), ('ops_per_second', 'ops/s', '{:.1f}'),
+               ('p50_ms', 'p50 ms', '{:.1f}'), ('p95_ms', 'p95 ms', '{:.1f}'),
+               ('p99_ms', 'p99 ms', '{:.1f}'), ('http_requests_per_op', 'http/op', '{:.2f}'),
+               ('api_calls_per_op', 'calls/op', '{:.2f}'), ('errors', 'errors', '{}')]
+    rows = [[title for _, title, _ in columns]]
+    rows += [[template.format(result[key]) for key, _, template in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+async def main(operations: list[str], sizes: list[int], concurrency_levels: list[int], count: int,
+               latency: float, error_rate: float, quota_units_per_second: float) -> list[dict[str, Any]]:
+    results = []
+    for name in operations:
+        for size in sizes:
+            for concurrency in concurrency_levels:
+                result = await run_case(name, size, concurrency, count, latency, error_rate,
+                                        quota_units_per_second)
+                logger.info(f"{name} size={size} concurrency={concurrency}: "
+                            f"{result['ops_per_second']:.1f} ops/s, p95 {result['p95_ms']:.1f} ms")
+                results.append(result)
+    return results
+
+def int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(',')]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark GmailService against a local fake Gmail backend')
+    parser.add_argument('--operations',
+                        default=','.join(OPERATIONS),
+                       help=f"Comma separated operations to run, from {', '.join(OPERATIONS)}")
+    parser.add_argument('--sizes',
+                        type=int_list,
+                        default=[100, 1000],
+                       help='Comma separated mailbox sizes')
+    parser.add_argument('--concurrency',
+                        type=int_list,
+                        default=[1, 8, 32],
+                       help='Comma separated numbers of concurrent callers')
+    parser.add_argument('--count',
+                        type=int,
+                        default=200,
+                       help='Operations per case')
+    parser.add_argument('--latency-ms',
+                        type=float,
+                        default=20.0,
+                       help='Latency added to every HTTP request by the fake backend')
+    parser.add_argument('--error-rate',
+                        type=float,
+                        default=0.0,
+                       help='Fraction of calls answered with 429 rateLimitExceeded')
+    parser.add_argument('--quota-units-per-second',
+                        type=float,
+                        default=1e9,
+                       help=f"Client-side quota pacing. Defaults to unthrottled, use {GMAIL_QUOTA_UNITS_PER_SECOND:g} "
+                            "to include Gmail's per-user limit")
+    parser.add_argument('--json',
+                        default=None,
+                       help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    operations = args.operations.split(',')
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"Unknown operations: {', '.join(sorted(unknown))}")
+    # The service logs every call at INFO, which would drown the report
+    logging.getLogger('gmail_mcp_server').setLevel(logging.WARNING)
+    logging.getLogger('googleapiclient').setLevel(logging.WARNING)
+
+    results = asyncio.run(main(operations, args.sizes, args.concurrency, args.count,
+                               args.latency_ms / 1000, args.error_rate, args.quota_units_per_second))
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,30 +1,63 @@
-from typing import Any
+import time
+# Taken before the heavy imports so startup timings include them
+PROCESS_START = time.perf_counter()
+
+from typing import IO, Any, Awaitable, Callable, Iterable, Iterator, TypeVar
 import argparse
+import bisect
 import os
 import asyncio
+import contextlib
+import functools
+import hashlib
+import random
+import re
 import logging
 import base64
+import binascii
+import codecs
+import datetime
 import mimetypes
-from email.message import EmailMessage
+import heapq
+import html
+import itertools
+import json
+import quopri
+import signal
+import sqlite3
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage, Message
 from email.header import decode_header
 from base64 import urlsafe_b64decode
-from email import message_from_bytes
+from email.parser import BytesHeaderParser
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
+from email.utils import parsedate_to_datetime
 import webbrowser
+from html.parser import HTMLParser
 
 from mcp.server.models import InitializationOptions
 import mcp.types as types
 from mcp.server import NotificationOptions, Server
 import mcp.server.stdio
+from mcp.server.lowlevel.helper_types import ReadResourceContents
+from pydantic import AnyUrl
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+import google_auth_httplib2
+import httplib2
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -36,11 +69,19 @@ You've been given access to a specific gmail account.
 You have the following tools available:
 - Send an email (send-email)
 - Send an email with attachment (send-email-with-attachment)
+- Send a personalised copy of an email to many recipients (send-bulk-email)
 - Retrieve unread emails (get-unread-emails)
 - Read email content (read-email)
+- Read the rest of a truncated email body (read-email-body)
+- Read a whole conversation (read-thread)
+- Search emails (search-emails)
+- Save an email attachment to disk (download-attachment)
 - Trash email (tras-email)
+- Mark many emails as read (mark-emails-as-read)
+- Trash many emails (trash-emails)
 - Open email in browser (open-email)
-Never send an email draft or trash an email unless the user confirms first. 
+Never send an email draft, send a mail merge or trash an email unless the user confirms first. 
+Before send-bulk-email, show the user the templates and the recipient list. 
 Always ask for approval if not already given.
 """
 
@@ -90,37 +131,622 @@ PROMPTS = {
     ),
 }
 
+# Gmail accepts at most 100 sub-requests per batch HTTP request
+BATCH_LIMIT = 100
+# users.messages.batchModify accepts at most 1000 message IDs per request
+BATCH_MODIFY_LIMIT = 1000
+SUMMARY_HEADERS = ['From', 'Subject', 'Date']
+READ_HEADERS = ['From', 'To', 'Subject', 'Date']
+READ_MODES = ['raw', 'text', 'headers']
+MESSAGE_CACHE_MEMORY_BYTES = 16 * 1024 * 1024
+MESSAGE_CACHE_DISK_BYTES = 256 * 1024 * 1024
+# Prefetching is off unless a count is given
+PREFETCH_COUNT = 0
+PREFETCH_MEMORY_BYTES = 8 * 1024 * 1024
+UNREAD_QUERY = 'in:inbox is:unread category:primary'
+# Labels a message must carry to match UNREAD_QUERY
+UNREAD_LABELS = frozenset({'INBOX', 'UNREAD', 'CATEGORY_PERSONAL'})
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+UNREAD_PAGE_FIELDS = 'messages(id,threadId),nextPageToken,resultSizeEstimate'
+# Gmail caps maxResults for users.messages.list at 500
+MAX_PAGE_SIZE = 500
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_REQUEST_TIMEOUT = 60.0
+# Gmail allows each user 250 quota units per second
+GMAIL_QUOTA_UNITS_PER_SECOND = 250.0
+# Quota units charged per Gmail API method
+QUOTA_COSTS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.trash': 5,
+    'gmail.users.messages.attachments.get': 5,
+    'gmail.users.threads.get': 10,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.send': 100,
+}
+DEFAULT_QUOTA_COST = 5
+# Sends are not repeated after a server error since Gmail may already have delivered them
+NON_IDEMPOTENT_METHODS = frozenset({'gmail.users.messages.send'})
+# Interactive reads are served before bulk work waiting on the same quota
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+MAX_RETRIES = 5
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 32.0
+DEFAULT_ACCOUNT = 'default'
+MAX_ACTIVE_ACCOUNTS = 16
+# Accounts unused for this many seconds are closed
+ACCOUNT_IDLE_TIMEOUT = 900.0
+# Credentials are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300.0
+TOKEN_REFRESH_RETRY_DELAY = 30.0
+# Attachments larger than this are streamed through the resumable upload endpoint
+RESUMABLE_UPLOAD_THRESHOLD = 5 * 1024 * 1024
+# Resumable upload chunks must be a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = 4 * 256 * 1024
+UPLOAD_MAX_RETRIES = 5
+UPLOAD_TIMEOUT = 900.0
+MARK_READ_FLUSH_INTERVAL = 5.0
+MARK_READ_MAX_ATTEMPTS = 5
+UNREAD_RESOURCE_URI = 'gmail://unread'
+# Summaries of at most this many of the newest unread emails are in the unread resource
+UNREAD_RESOURCE_MAX_MESSAGES = 50
+# The unread watcher polls history this often after a change or a tool call,
+# doubling the interval up to the maximum while nothing changes
+UNREAD_WATCH_MIN_INTERVAL = 5.0
+UNREAD_WATCH_MAX_INTERVAL = 300.0
+HTTP_HOST = '127.0.0.1'
+HTTP_PORT = 8000
+HTTP_PATH = '/mcp'
+# Tool calls one HTTP client session may run at once, more wait their turn
+SESSION_CONCURRENCY = 4
+SHUTDOWN_TIMEOUT = 30
+# Email bodies are decoded up to this many bytes, the rest is dropped
+BODY_MAX_BYTES = 1024 * 1024
+HEADER_MAX_BYTES = 256 * 1024
+MIME_MAX_DEPTH = 16
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_RESOURCE_URI = 'gmail://metrics'
+# Tool responses are cut to this many bytes of JSON, longer bodies continue with read-email-body
+MAX_RESPONSE_BYTES = 32 * 1024
+# Room left in the budget for a truncated body's continuation fields
+CONTINUATION_OVERHEAD = 256
+# Typical JSON size of one email summary, used to size listings that include metadata
+SUMMARY_RESPONSE_BYTES = 320
+METRICS_DUMP_INTERVAL = 15.0
+# 57 bytes encode to one 76 character base64 line, so reads stay line aligned
+ATTACHMENT_READ_SIZE = 57 * 16 * 1024
+# base64 characters decoded per step when saving a downloaded attachment, a multiple of 4
+ATTACHMENT_DECODE_CHUNK = 4 * 256 * 1024
+ATTACHMENT_CACHE_BYTES = 32 * 1024 * 1024
+BULK_SEND_CONCURRENCY = 4
+BULK_SEND_MAX_CONCURRENCY = 16
+# Gmail's daily sending limit for consumer accounts
+BULK_SEND_MAX_RECIPIENTS = 500
+# How long a mail merge counts as already sent: with the derived default key only retries
+# shortly after the first call are deduplicated, an explicit key is remembered for a week
+BULK_SEND_DEFAULT_KEY_TTL = 60 * 60
+BULK_SEND_KEY_TTL = 7 * 24 * 60 * 60
+# A send without an answer may still be running in a worker thread, or not yet be found
+# in the Sent folder, so it is reported pending rather than sent again for this long
+BULK_SEND_PENDING_TIMEOUT = UPLOAD_TIMEOUT
+MERGE_FIELD_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+T = TypeVar('T')
+
+def payload_fields(depth: int = 4) -> str:
+    """Fields mask for a message payload with parts nested depth levels deep.
+    Selects part structure, headers and inline body data."""
+    part_fields = 'partId,mimeType,filename,headers,body(size,attachmentId,data)'
+    fields = part_fields
+    for _ in range(depth):
+        fields = f'{part_fields},parts({fields})'
+    return fields
+
+FULL_MESSAGE_FIELDS = f'id,threadId,historyId,snippet,payload({payload_fields()})'
+THREAD_FIELDS = f'id,historyId,messages({FULL_MESSAGE_FIELDS},labelIds)'
+
+def walk_payload(part: dict):
+    """Yields a Gmail message payload part and all its nested parts, depth first"""
+    yield part
+    for sub_part in part.get('parts', []):
+        yield from walk_payload(sub_part)
+
+def payload_headers(part: dict) -> dict[str, str]:
+    """Headers of a payload part keyed by lower-case name"""
+    return {header['name'].lower(): header['value'] for header in part.get('headers', [])}
+
+# Separators that start the original message in a reply, everything after them is quoted
+QUOTE_SEPARATOR_PATTERNS = (
+    re.compile(r'^-+ ?Original Message ?-+$', re.IGNORECASE),
+    re.compile(r'^_{10,}$'),
+)
+# Attribution of the quoted original, only one when '>' quoted lines follow it
+QUOTE_ATTRIBUTION_PATTERN = re.compile(r'^On .+wrote:$')
+
+def strip_quoted_reply(text: str) -> str:
+    """
+    Returns the new content of a reply without the quoted earlier messages.
+    Everything from a "-----Original Message-----" or Outlook separator is cut, and from an
+    "On ... wrote:" attribution when '>' quoted lines follow it. Prose that reads like an
+    attribution is kept. Remaining '>' quoted lines are dropped.
+    If nothing would be left the text is returned whole, it was not a reply."""
+    lines = text.splitlines()
+
+    def quoted_from(index: int) -> bool:
+        following = [line.strip() for line in lines[index:] if line.strip()]
+        return bool(following) and following[0].startswith('>')
+
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if any(pattern.match(stripped) for pattern in QUOTE_SEPARATOR_PATTERNS):
+            lines = lines[:index]
+            break
+        if QUOTE_ATTRIBUTION_PATTERN.match(stripped) and quoted_from(index + 1):
+            lines = lines[:index]
+            break
+        # Mail clients wrap long attributions over two lines
+        if index + 1 < len(lines) and not stripped.endswith(('.', '!', '?')):
+            joined = f"{stripped} {lines[index + 1].strip()}"
+            if QUOTE_ATTRIBUTION_PATTERN.match(joined) and quoted_from(index + 2):
+                lines = lines[:index]
+                break
+    kept = [line for line in lines if not line.lstrip().startswith('>')]
+    return '\n'.join(kept).strip() or text.strip()
+
+def encode_page_token(query: str, gmail_token: str) -> str:
+    """Wraps a Gmail pageToken and the query it belongs to into an opaque cursor"""
+    cursor = json.dumps({'q': query, 'page': gmail_token}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+def decode_page_token(query: str, page_token: str) -> str:
+    """Returns the Gmail pageToken from a cursor made by encode_page_token for the same query"""
+    try:
+        cursor = json.loads(urlsafe_b64decode(page_token.encode()))
+    except ValueError:
+        raise ValueError("Invalid page token")
+    if not isinstance(cursor, dict) or cursor.get('q') != query:
+        raise ValueError("Page token does not belong to this listing")
+    page = cursor.get('page')
+    if not isinstance(page, str) or not page:
+        raise ValueError("Invalid page token")
+    return page
+
+def render_template(template: str, fields: dict[str, Any]) -> str:
+    """Replaces {{name}} placeholders with fields[name], raising ValueError for missing fields"""
+    def field(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in fields:
+            raise ValueError(f"Missing merge field: {name}")
+        return str(fields[name])
+    return MERGE_FIELD_PATTERN.sub(field, template)
+
+def idempotency_key(*parts: str) -> str:
+    """Stable key for a send, derived from everything that makes it unique"""
+    return hashlib.sha256('\0'.join(parts).encode()).hexdigest()[:32]
+
+def encode_continuation_token(email_id: str, mode: str, offset: int) -> str:
+    """Opaque cursor to the rest of an email body, starting offset bytes into its UTF-8 encoding"""
+    cursor = json.dumps({'id': email_id, 'mode': mode, 'offset': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+def decode_continuation_token(token: str) -> tuple[str, str, int]:
+    """Returns (email ID, read mode, byte offset) from a cursor made by encode_continuation_token"""
+    try:
+        cursor = json.loads(urlsafe_b64decode(token.encode()))
+        return cursor['id'], cursor['mode'], int(cursor['offset'])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid continuation token")
+
+def json_text(result: Any) -> str:
+    """Compact JSON for tool responses"""
+    return json.dumps(result, separators=(',', ':'), ensure_ascii=False, default=str)
+
+def utf8_prefix(data: bytes, max_bytes: int) -> bytes:
+    """At most max_bytes of UTF-8 data, cut on a character boundary"""
+    end = min(len(data), max(max_bytes, 0))
+    while 0 < end < len(data) and (data[end] & 0xC0) == 0x80:
+        end -= 1
+    return data[:end]
+
+def bound_email_bodies(emails: list[dict[str, Any]], email_ids: list[str], mode: str,
+                       max_bytes: int) -> list[dict[str, Any]]:
+    """
+    Truncates the 'content' of emails so their JSON fits in max_bytes.
+    The budget is shared fairly, short bodies are kept whole and the rest split what is left.
+    A truncated email gets truncated, content_bytes and a continuation_token for read-email-body.
+    An email's 'offset' key says where its content starts in the full body, 0 if missing."""
+    bodies = [(email.get('content') or '').encode() for email in emails]
+    fixed = len(json_text([{**email, 'content': ''} for email in emails]).encode())
+    budget = max_bytes - fixed - CONTINUATION_OVERHEAD * len(emails)
+    while True:
+        allowances = [0] * len(emails)
+        remaining = max(budget, 0)
+        order = sorted(range(len(emails)), key=lambda i: len(bodies[i]))
+        for position, i in enumerate(order):
+            allowances[i] = min(len(bodies[i]), remaining // (len(order) - position))
+            remaining -= allowances[i]
+
+        bounded = []
+        for email, email_id, body, allowance in zip(emails, email_ids, bodies, allowances):
+            if allowance >= len(body):
+                bounded.append(email)
+                continue
+            kept = utf8_prefix(body, allowance)
+            offset = email.get('offset', 0)
+            bounded.append({**email, 'content': kept.decode(), 'truncated': True,
+                            'content_bytes': offset + len(body),
+                            'continuation_token': encode_continuation_token(email_id, mode, offset + len(kept))})
+        size = len(json_text(bounded).encode())
+        # JSON escaping can grow the kept text, so shrink the budget until it fits.
+        # The excess is in escaped bytes, scale it back to body bytes so the budget
+        # does not collapse to nothing on escape-heavy bodies
+        if size <= max_bytes or budget <= 0:
+            return bounded
+        kept = sum(len(email['content'].encode()) for email in bounded)
+        escaped = len(json_text([email['content'] for email in bounded]).encode())
+        budget -= max(1, -(-(size - max_bytes) * kept // max(escaped, 1)))
+
+def fit_items(items: list[Any], budget: int) -> int:
+    """How many leading items fit in budget bytes of JSON, counting the separating commas"""
+    kept = 0
+    size = 0
+    for item in items:
+        size += len(json_text(item).encode()) + 1
+        if size > budget:
+            break
+        kept += 1
+    return kept
+
+def bound_response(result: Any, max_bytes: int) -> str:
+    """
+    JSON text of a tool result, at most max_bytes long.
+    Lists that do not fit are cut, and wrapped with how many items there were in total.
+    In an object the largest list is cut instead, with truncated set and its length in
+    '<key>_total', and if that is not enough the longest strings are shortened.
+    Strings, such as error messages, are returned as they are."""
+    if isinstance(result, str):
+        return result
+    text = json_text(result)
+    if len(text.encode()) <= max_bytes:
+        return text
+    if isinstance(result, list):
+        budget = max_bytes - len(json_text({'results': [], 'truncated': True, 'total': len(result)}).encode())
+        return json_text({'results': result[:fit_items(result, budget)], 'truncated': True, 'total': len(result)})
+    if not isinstance(result, dict):
+        return text
+
+    bounded = {**result, 'truncated': True}
+    lists = [key for key, value in result.items() if isinstance(value, list)]
+    if lists:
+        key = max(lists, key=lambda key: len(json_text(result[key]).encode()))
+        bounded[key] = []
+        bounded[f'{key}_total'] = len(result[key])
+        budget = max_bytes - len(json_text(bounded).encode())
+        bounded[key] = result[key][:fit_items(result[key], budget)]
+    while (excess := len(json_text(bounded).encode()) - max_bytes) > 0:
+        strings = [key for key, value in bounded.items() if isinstance(value, str) and value]
+        if not strings:
+            break
+        key = max(strings, key=lambda key: len(bounded[key].encode()))
+        data = bounded[key].encode()
+        bounded[key] = utf8_prefix(data, len(data) - excess).decode()
+    return json_text(bounded)
+
+def decode_text(data: bytes, charset: str | None, final: bool = True) -> str:
+    """Decodes bytes in the given charset, falling back to UTF-8 for unknown charsets.
+    Undecodable bytes become U+FFFD. With final=False a character cut off at the end is dropped."""
+    try:
+        decoder = codecs.getincrementaldecoder(charset or 'utf-8')(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    return decoder.decode(data, final=final)
+
 def decode_mime_header(header: str) -> str: 
     """Helper function to decode encoded email headers"""
     decoded_parts = decode_header(header)
     decoded_string = ''
     for part, encoding in decoded_parts: 
         if isinstance(part, bytes): 
-            # Decode bytes to string using the specified encoding 
-            decoded_string += part.decode(encoding or 'utf-8') 
+            # Decode bytes using the specified encoding, tolerating unknown or wrong ones
+            decoded_string += decode_text(part, encoding) 
         else: 
             # Already a string 
             decoded_string += part 
     return decoded_string
 
-class GmailService:
+def header_charset(content_type: str) -> str | None:
+    """charset parameter of a Content-Type header value"""
+    message = Message()
+    message['Content-Type'] = content_type
+    return message.get_content_charset()
+
+class HtmlTextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document, breaking lines at block elements"""
+    BLOCK_TAGS = frozenset({'address', 'article', 'blockquote', 'br', 'div', 'dd', 'dl', 'dt', 'footer',
+                            'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre',
+                            'section', 'table', 'td', 'th', 'tr', 'ul'})
+    SKIP_TAGS = frozenset({'head', 'script', 'style', 'template'})
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in self.SKIP_TAGS:
+            self._skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.SKIP_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data: str) -> None:
+        if not self._skipping:
+            self.parts.append(data)
+
+def html_to_text(markup: str) -> str:
+    """Plain text of an HTML body in one linear pass, whitespace collapsed within lines"""
+    extractor = HtmlTextExtractor()
+    extractor.feed(markup)
+    extractor.close()
+    lines = (' '.join(line.split()) for line in ''.join(extractor.parts).splitlines())
+    text = []
+    for line in lines:
+        # Keep at most one blank line between paragraphs
+        if line or (text and text[-1]):
+            text.append(line)
+    return '\n'.join(text).strip()
+
+def parse_header_block(data: bytes, start: int, end: int) -> tuple[Message, int]:
+    """Parses the headers of the MIME entity in data[start:end].
+    Returns them with the offset where the entity's body starts."""
+    blank_lines = [(pos, length) for pos, length in ((data.find(b'\r\n\r\n', start, end), 4),
+                                                     (data.find(b'\n\n', start, end), 2)) if pos != -1]
+    if not blank_lines:
+        return BytesHeaderParser().parsebytes(data[start:min(end, start + HEADER_MAX_BYTES)]), end
+    pos, length = min(blank_lines)
+    return BytesHeaderParser().parsebytes(data[start:min(pos, start + HEADER_MAX_BYTES)]), pos + length
+
+def iter_mime_parts(data: bytes, start: int = 0, end: int | None = None,
+                    depth: int = 0) -> Iterator[tuple[Message, int, int]]:
+    """
+    Yields (headers, body start, body end) for every leaf part of a raw RFC 2822 message.
+    Boundaries are found with bytes.find and only header blocks are parsed, so walking a
+    message costs neither a copy of it nor the email package's per-line parsing."""
+    end = len(data) if end is None else end
+    headers, body_start = parse_header_block(data, start, end)
+    boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+    if not boundary or depth >= MIME_MAX_DEPTH:
+        yield headers, body_start, end
+        return
+    delimiter = b'--' + boundary.encode('ascii', 'replace')
+    pos = data.find(delimiter, body_start, end)
+    # A delimiter only counts at the start of a line
+    while pos > body_start and data[pos - 1:pos] != b'\n':
+        pos = data.find(delimiter, pos + 1, end)
+    while pos != -1:
+        if data[pos + len(delimiter):pos + len(delimiter) + 2] == b'--':
+            return
+        part_start = data.find(b'\n', pos, end)
+        if part_start == -1:
+            return
+        next_pos = data.find(b'\n' + delimiter, part_start, end)
+        part_end = end if next_pos == -1 else next_pos
+        if data[part_end - 1:part_end] == b'\r':
+            part_end -= 1
+        yield from iter_mime_parts(data, part_start + 1, part_end, depth + 1)
+        pos = -1 if next_pos == -1 else next_pos + 1
+
+def transfer_decode(data: bytes, start: int, end: int, encoding: str, max_bytes: int) -> tuple[bytes, bool]:
+    """
+    Undoes the Content-Transfer-Encoding of data[start:end], producing at most max_bytes.
+    Only the prefix of the encoded body needed for max_bytes is read.
+    Returns the bytes and whether the body was cut."""
+    encoding = encoding.strip().lower()
+    if encoding == 'base64':
+        # 4 characters carry 3 bytes, twice max_bytes leaves room for line breaks
+        window_end = min(end, start + max_bytes * 2)
+        encoded = b''.join(data[start:window_end].split())
+        try:
+            decoded = binascii.a2b_base64(encoded[:len(encoded) // 4 * 4])
+        except binascii.Error:
+            decoded = b''
+    elif encoding == 'quoted-printable':
+        # An escape sequence is 3 characters for one byte
+        window_end = min(end, start + max_bytes * 3)
+        decoded = quopri.decodestring(data[start:window_end])
+    else:
+        window_end = min(end, start + max_bytes + 1)
+        decoded = data[start:window_end]
+    return decoded[:max_bytes], window_end < end or len(decoded) > max_bytes
+
+def message_body(raw: bytes, max_bytes: int) -> tuple[str | None, bool]:
+    """
+    Text body of a raw email, visiting one part at a time and decoding at most max_bytes.
+    Uses the first text/plain part in its declared charset, or converts the first text/html
+    part when there is none. Returns (text or None, whether it was cut at max_bytes)."""
+    html_part = None
+    for headers, start, end in iter_mime_parts(raw):
+        if headers.get_content_disposition() == 'attachment':
+            continue
+        content_type = headers.get_content_type()
+        if content_type == 'text/plain':
+            data, cut = transfer_decode(raw, start, end, headers.get('content-transfer-encoding', ''), max_bytes)
+            return decode_text(data, headers.get_content_charset(), final=not cut), cut
+        if content_type == 'text/html' and html_part is None:
+            html_part = (headers, start, end)
+    if html_part is None:
+        return None, False
+    headers, start, end = html_part
+    data, cut = transfer_decode(raw, start, end, headers.get('content-transfer-encoding', ''), max_bytes)
+    return html_to_text(decode_text(data, headers.get_content_charset(), final=not cut)), cut
+
+def quota_cost(request: Any) -> int:
+    """Gmail quota units charged for a googleapiclient request"""
+    return QUOTA_COSTS.get(getattr(request, 'methodId', None), DEFAULT_QUOTA_COST)
+
+def retry_delay(error: HttpError, attempt: int, idempotent: bool = True) -> float | None:
+    """
+    Seconds to wait before retrying a failed request, or None if it should not be retried.
+    Uses exponential backoff with full jitter, but never less than the Retry-After header."""
+    status = error.resp.status
+    if status == 403:
+        if not any(reason.encode() in (error.content or b'') for reason in RATE_LIMIT_REASONS):
+            return None
+    elif status not in RETRY_STATUSES or (status >= 500 and not idempotent):
+        return None
+
+    retry_after = 0.0
+    header = error.resp.get('retry-after')
+    if header:
+        try:
+            retry_after = float(header)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(header)
+                retry_after = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    backoff = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+    return max(retry_after, backoff)
+
+class QuotaScheduler:
+    """
+    Paces Gmail API calls against the per-user quota.
+    A token bucket holds up to one second of quota units. Calls wait for their cost in units,
+    and waiting calls are served in priority order, then first come first served.
+    Rate limit and server errors are retried with backoff, and a rate limit response empties
+    the bucket so every caller slows down."""
+
+    def __init__(self, units_per_second: float = GMAIL_QUOTA_UNITS_PER_SECOND, max_retries: int = MAX_RETRIES):
+        self.rate = units_per_second
+        self.capacity = units_per_second
+        self.max_retries = max_retries
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._waiters: list[tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self.units_used = 0.0
+        self.throttled_seconds = 0.0
+        self.retries = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, cost: float, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait until cost quota units are available.
+        Costs above the bucket size wait for a full bucket and leave it in debt."""
+        self._refill()
+        self.units_used += cost
+        if not self._waiters and self._tokens >= min(cost, self.capacity):
+            self._tokens -= cost
+            return
+
+        began = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), cost, future))
+        self._schedule()
+        try:
+            await future
+        finally:
+            self.throttled_seconds += time.monotonic() - began
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, cost, future = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if self._tokens < min(cost, self.capacity):
+                break
+            heapq.heappop(self._waiters)
+            self._tokens -= cost
+            future.set_result(None)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self._waiters:
+            return
+        cost = min(self._waiters[0][2], self.capacity)
+        delay = max((cost - self._tokens) / self.rate, 0.001)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def backoff(self) -> None:
+        """Empty the bucket after Gmail reported a rate limit"""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+    async def call(self, func: Callable[[], Awaitable[T]], cost: float,
+                   priority: int = PRIORITY_INTERACTIVE, idempotent: bool = True) -> T:
+        """Run func once its quota is available, retrying rate limit and server errors"""
+        attempt = 0
+        while True:
+            await self.acquire(cost, priority)
+            try:
+                return await func()
+            except HttpError as error:
+                delay = retry_delay(error, attempt, idempotent)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                if error.resp.status in (403, 429):
+                    self.backoff()
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"Gmail returned {error.resp.status}, retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            'units_used': self.units_used,
+            'throttled_seconds': self.throttled_seconds,
+            'retries': self.retries,
+            'waiting': len(self._waiters),
+        }
+
+class CredentialManager:
+    """Owns the OAuth credentials of one account and refreshes them ahead of expiry
+    on a background task, so no API call waits on a refresh.
+    A refresh builds a new Credentials object and swaps it in under a lock. Executor threads
+    pick it up on their next call, and the token file is rewritten atomically."""
+
     def __init__(self,
                  creds_file_path: str,
                  token_path: str,
-                 scopes: list[str] = ['https://www.googleapis.com/auth/gmail.modify']):
-        logger.info(f"Initializing GmailService with creds file: {creds_file_path}")
+                 scopes: list[str],
+                 refresh_margin: float = TOKEN_REFRESH_MARGIN):
         self.creds_file_path = creds_file_path
         self.token_path = token_path
         self.scopes = scopes
-        self.token = self._get_token()
-        logger.info("Token retrieved successfully")
-        self.service = self._get_service()
-        logger.info("Gmail service initialized")
-        self.user_email = self._get_user_email()
-        logger.info(f"User email retrieved: {self.user_email}")
+        self.refresh_margin = refresh_margin
+        self._credentials: Credentials | None = None
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def credentials(self) -> Credentials:
+        """Current valid credentials"""
+        with self._lock:
+            return self._credentials
 
-    def _get_token(self) -> Credentials:
-        """Get or refresh Google API token"""
+    def load(self) -> Credentials:
+        """Get or refresh Google API token, running the OAuth flow if there is none"""
         token = None
     
         if os.path.exists(self.token_path):
@@ -135,27 +761,1191 @@ class GmailService:
                 logger.info('Fetching new token')
                 flow = InstalledAppFlow.from_client_secrets_file(self.creds_file_path, self.scopes)
                 token = flow.run_local_server(port=0)
+            self._save(token)
 
-            with open(self.token_path, 'w') as token_file:
-                token_file.write(token.to_json())
-                logger.info(f'Token saved to {self.token_path}')
+        with self._lock:
+            self._credentials = token
+        return token
+
+    def _save(self, token: Credentials) -> None:
+        """Atomically write the token file"""
+        tmp_path = f"{self.token_path}.tmp"
+        with open(tmp_path, 'w') as token_file:
+            token_file.write(token.to_json())
+        os.replace(tmp_path, self.token_path)
+        logger.info(f'Token saved to {self.token_path}')
 
+    def refresh(self) -> Credentials:
+        """Refresh into a new Credentials object and make it current"""
+        current = self.credentials
+        token = Credentials.from_authorized_user_info(json.loads(current.to_json()), self.scopes)
+        token.refresh(Request())
+        self._save(token)
+        with self._lock:
+            self._credentials = token
         return token
 
+    def seconds_until_refresh(self) -> float | None:
+        """Seconds until the current credentials should be refreshed, None if they never expire"""
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return None
+        # google-auth keeps expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return max(0.0, (expiry - now).total_seconds() - self.refresh_margin)
+
+    def start(self) -> None:
+        """Start refreshing in the background, once credentials are loaded"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            delay = self.seconds_until_refresh()
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+            try:
+                await asyncio.to_thread(self.refresh)
+                logger.info(f"Token refreshed ahead of expiry, valid until {self.credentials.expiry}")
+            except Exception as error:
+                logger.warning(f"Background token refresh failed, retrying: {error}")
+                await asyncio.sleep(TOKEN_REFRESH_RETRY_DELAY)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, cheap to update on every call"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile, the largest bound if it overflows"""
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+    def summary(self) -> dict[str, float]:
+        return {
+            'count': self.count,
+            'mean_ms': self.sum / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.quantile(0.50) * 1000,
+            'p95_ms': self.quantile(0.95) * 1000,
+            'p99_ms': self.quantile(0.99) * 1000,
+        }
+
+class Metrics:
+    """
+    Process-wide counters for tool calls and the Gmail API boundary.
+    Updates take one uncontended lock and a few dict operations, so they stay on in production.
+    Each tracked API call counts its methods and quota units, batches count every sub-request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tool_latency: dict[str, LatencyHistogram] = {}
+        self.tool_errors: dict[str, int] = {}
+        self.tools_in_flight = 0
+        self.api_latency: dict[str, LatencyHistogram] = {}
+        self.api_errors: dict[str, int] = {}
+        self.api_calls: dict[str, int] = {}
+        self.quota_units: dict[str, int] = {}
+        self.api_in_flight = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @contextlib.contextmanager
+    def track_tool(self, name: str):
+        """Time an MCP tool call and count it as in flight meanwhile"""
+        with self._lock:
+            self.tools_in_flight += 1
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.tools_in_flight -= 1
+                self.tool_latency.setdefault(name, LatencyHistogram()).observe(elapsed)
+                if failed:
+                    self.tool_errors[name] = self.tool_errors.get(name, 0) + 1
+
+    @contextlib.contextmanager
+    def track_api_call(self, methods: list[str]):
+        """Time one HTTP call to Gmail carrying the given API methods, a batch if more than one"""
+        label = methods[0] if len(methods) == 1 else 'batch'
+        with self._lock:
+            self.api_in_flight += 1
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.api_in_flight -= 1
+                self.api_latency.setdefault(label, LatencyHistogram()).observe(elapsed)
+                if failed:
+                    self.api_errors[label] = self.api_errors.get(label, 0) + 1
+                for method in methods:
+                    self.api_calls[method] = self.api_calls.get(method, 0) + 1
+                    self.quota_units[method] = self.quota_units.get(method, 0) + \
+                        QUOTA_COSTS.get(method, DEFAULT_QUOTA_COST)
+
+    def add_transfer(self, sent: int, received: int) -> None:
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def snapshot(self) -> dict[str, Any]:
+        """Current values with latency summarized as bucket-resolution percentiles"""
+        with self._lock:
+            return {
+                'tools': {name: {**histogram.summary(), 'errors': self.tool_errors.get(name, 0)}
+                          for name, histogram in self.tool_latency.items()},
+                'tools_in_flight': self.tools_in_flight,
+                'api_latency': {label: {**histogram.summary(), 'errors': self.api_errors.get(label, 0)}
+                                for label, histogram in self.api_latency.items()},
+                'api_calls': dict(self.api_calls),
+                'quota_units': dict(self.quota_units),
+                'api_in_flight': self.api_in_flight,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+            }
+
+    def prometheus(self, accounts: dict[str, dict[str, Any]] | None = None) -> str:
+        """Metrics in the Prometheus text exposition format, with per-account cache and quota stats"""
+        lines = []
+
+        def escape(value: Any) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def histogram(name: str, label: str, histograms: dict[str, LatencyHistogram]) -> None:
+            lines.append(f"# TYPE {name} histogram")
+            for value, histogram in histograms.items():
+                value = escape(value)
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+
+        def series(name: str, kind: str, label: str, values: dict[str, Any]) -> None:
+            lines.append(f"# TYPE {name} {kind}")
+            for value, number in values.items():
+                lines.append(f'{name}{{{label}="{escape(value)}"}} {number}')
+
+        with self._lock:
+            histogram('gmail_tool_duration_seconds', 'tool', self.tool_latency)
+            series('gmail_tool_errors_total', 'counter', 'tool', self.tool_errors)
+            lines += ["# TYPE gmail_tools_in_flight gauge", f"gmail_tools_in_flight {self.tools_in_flight}"]
+            histogram('gmail_api_request_duration_seconds', 'method', self.api_latency)
+            series('gmail_api_request_errors_total', 'counter', 'method', self.api_errors)
+            series('gmail_api_calls_total', 'counter', 'method', self.api_calls)
+            series('gmail_quota_units_total', 'counter', 'method', self.quota_units)
+            lines += ["# TYPE gmail_api_requests_in_flight gauge",
+                      f"gmail_api_requests_in_flight {self.api_in_flight}"]
+            series('gmail_transfer_bytes_total', 'counter', 'direction',
+                   {'sent': self.bytes_sent, 'received': self.bytes_received})
+
+        for key, kind in (('memory_hits', 'counter'), ('disk_hits', 'counter'), ('misses', 'counter'),
+                          ('evictions', 'counter'), ('memory_bytes', 'gauge'),
+                          ('disk_evictions', 'counter'), ('disk_bytes', 'gauge')):
+            name = f"gmail_cache_{key}" + ('_total' if kind == 'counter' else '')
+            series(name, kind, 'account', {account: stats['cache'][key]
+                                           for account, stats in (accounts or {}).items()})
+        for key in ('throttled_seconds', 'retries'):
+            series(f"gmail_quota_{key}_total", 'counter', 'account',
+                   {account: stats['quota'][key] for account, stats in (accounts or {}).items()})
+        for key, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                          ('bytes', 'gauge')):
+            name = f"gmail_attachment_cache_{key}" + ('_total' if kind == 'counter' else '')
+            series(name, kind, 'account', {account: stats['attachment_cache'][key]
+                                           for account, stats in (accounts or {}).items()})
+        for key, kind in (('prefetched', 'counter'), ('hits', 'counter'), ('unused', 'counter'),
+                          ('cancelled', 'counter'), ('bytes', 'gauge')):
+            name = f"gmail_prefetch_{key}" + ('_total' if kind == 'counter' else '')
+            series(name, kind, 'account', {account: stats['prefetch'][key]
+                                           for account, stats in (accounts or {}).items()})
+        return '\n'.join(lines) + '\n'
+
+class MeteredHttp(httplib2.Http):
+    """httplib2 transport that counts request and response body bytes"""
+
+    def __init__(self, metrics: Metrics, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    def request(self, uri: str, method: str = 'GET', body: Any = None, headers: Any = None,
+                *args: Any, **kwargs: Any) -> tuple[Any, bytes]:
+        response, content = super().request(uri, method, body, headers, *args, **kwargs)
+        if body is None or isinstance(body, (bytes, str)):
+            sent = len(body) if body else 0
+        else:
+            # Resumable upload chunks are streams, sized by their Content-Length header
+            sent = next((int(value) for name, value in (headers or {}).items()
+                         if name.lower() == 'content-length'), 0)
+        self.metrics.add_transfer(sent, len(content) if content else 0)
+        return response, content
+
+class GoogleApiExecutor:
+    """Runs blocking Google API calls on a bounded thread pool.
+    httplib2 is not thread-safe, so each worker thread owns its transport and authorizes it
+    separately for every set of credentials it is handed."""
+
+    def __init__(self,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 metrics: Metrics | None = None):
+        self.timeout = timeout
+        self.metrics = metrics or Metrics()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gmail-api')
+        self._local = threading.local()
+
+    def _http(self, credentials: Credentials) -> google_auth_httplib2.AuthorizedHttp:
+        """Authorized transport owned by the calling worker thread"""
+        local = self._local
+        if not hasattr(local, 'transport'):
+            local.transport = MeteredHttp(self.metrics, timeout=self.timeout)
+            # Resumable uploads answer 308 while incomplete, which is not a redirect
+            local.transport.redirect_codes = local.transport.redirect_codes - {308}
+            local.authorized = weakref.WeakKeyDictionary()
+        http = local.authorized.get(credentials)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(credentials, http=local.transport)
+            local.authorized[credentials] = http
+        return http
+
+    async def run(self, func: Callable[[google_auth_httplib2.AuthorizedHttp], T],
+                  credentials: Credentials, timeout: float | None = None) -> T:
+        """Run func(http) on a worker thread, giving up after timeout seconds.
+        Cancelling the caller cancels the call if it has not started yet."""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, lambda: func(self._http(credentials)))
+        return await asyncio.wait_for(future, timeout or self.timeout)
+
+    async def execute(self, request: Any, credentials: Credentials, timeout: float | None = None) -> Any:
+        """Execute a googleapiclient request on the pool"""
+        return await self.run(lambda http: request.execute(http=http), credentials, timeout)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+class MarkReadQueue:
+    """Coalesces mark-as-read requests and flushes them in the background as one batchModify.
+    Flushes every interval seconds, or sooner once max_size IDs are pending.
+    Failed IDs are retried on later flushes, and close() drains what is left."""
+
+    def __init__(self,
+                 flush: Callable[[list[str]], Awaitable[dict[str, str | None]]],
+                 interval: float = MARK_READ_FLUSH_INTERVAL,
+                 max_size: int = BATCH_MODIFY_LIMIT,
+                 max_attempts: int = MARK_READ_MAX_ATTEMPTS):
+        self._flush = flush
+        self.interval = interval
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        # Pending email IDs and how many flushes of each have failed
+        self._pending: dict[str, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    def add(self, email_id: str) -> None:
+        """Queue an email to be marked as read"""
+        self._pending.setdefault(email_id, 0)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if len(self._pending) >= self.max_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Mark all pending emails as read now"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            outcomes = await self._flush(list(batch))
+            failed = {email_id: error for email_id, error in outcomes.items() if error is not None}
+        except asyncio.CancelledError:
+            # Put the batch back so a later flush still marks it
+            for email_id, attempts in batch.items():
+                self._pending.setdefault(email_id, attempts)
+            raise
+        except Exception as error:
+            failed = dict.fromkeys(batch, str(error))
+        logger.info(f"Marked {len(batch) - len(failed)}/{len(batch)} queued emails as read")
+
+        for email_id, error in failed.items():
+            attempts = batch[email_id] + 1
+            if attempts >= self.max_attempts:
+                logger.error(f"Giving up marking email {email_id} as read: {error}")
+            else:
+                self._pending.setdefault(email_id, attempts)
+
+    async def close(self) -> None:
+        """Stop the background flush and drain pending emails.
+        A flush already running is waited for rather than cancelled."""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._closing = False
+        await self.flush()
+
+class UnreadWatcher:
+    """
+    Polls for unread changes in the background and calls notify when the unread set changed.
+    check() syncs the mailbox and returns whether anything changed. The poll interval starts at
+    min_interval, doubles while nothing changes up to max_interval, and falls back to
+    min_interval after a change or when activity() reports the mailbox is in use."""
+
+    def __init__(self,
+                 check: Callable[[], Awaitable[bool]],
+                 notify: Callable[[], Awaitable[None]],
+                 min_interval: float = UNREAD_WATCH_MIN_INTERVAL,
+                 max_interval: float = UNREAD_WATCH_MAX_INTERVAL):
+        self._check = check
+        self._notify = notify
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.checks = 0
+        self.notifications = 0
+        self._next_check = time.monotonic() + min_interval
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def activity(self) -> None:
+        """Check again within min_interval"""
+        self.interval = self.min_interval
+        self._next_check = min(self._next_check, time.monotonic() + self.min_interval)
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            delay = self._next_check - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.checks += 1
+            try:
+                changed = await self._check()
+            except Exception as error:
+                logger.warning(f"Unread check failed: {error}")
+                changed = False
+            if changed:
+                self.notifications += 1
+                try:
+                    await self._notify()
+                except Exception as error:
+                    logger.warning(f"Unread notification failed: {error}")
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+            self._next_check = time.monotonic() + self.interval
+
+    def stop(self) -> None:
+        """Cancel polling without waiting for it to finish"""
+        if self._task is not None:
+            self._task.cancel()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class MessageCache:
+    """Two-tier cache for read messages.
+    Parsed emails live in an in-memory LRU bounded by a byte budget, raw payloads
+    in a SQLite store keyed by message ID and historyId, also evicted least recently
+    used first once it grows past its own byte budget.
+    The disk tier blocks, so async callers run it in a thread."""
+
+    def __init__(self, db_path: str, memory_budget: int = MESSAGE_CACHE_MEMORY_BYTES,
+                 disk_budget: int = MESSAGE_CACHE_DISK_BYTES):
+        self.db_path = db_path
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self._memory: OrderedDict[str, tuple[int, dict[str, str], int]] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'id TEXT NOT NULL, history_id INTEGER NOT NULL, raw BLOB NOT NULL, used INTEGER NOT NULL, '
+            'PRIMARY KEY (id, history_id))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS messages_used ON messages (used)')
+        self._db.commit()
+        self._disk_bytes, self._clock = self._db.execute(
+            'SELECT COALESCE(SUM(LENGTH(raw)), 0), COALESCE(MAX(used), 0) FROM messages').fetchone()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.invalidations = 0
+        with self._lock:
+            self._evict_disk()
+
+    def get_parsed(self, message_id: str) -> dict[str, str] | None:
+        """Return a copy of the parsed email from the memory tier"""
+        with self._lock:
+            entry = self._memory.get(message_id)
+            if entry is None:
+                return None
+            self._memory.move_to_end(message_id)
+            self.memory_hits += 1
+            return dict(entry[1])
+
+    def has_parsed(self, message_id: str) -> bool:
+        """Whether a parsed email is in the memory tier, without counting a lookup"""
+        with self._lock:
+            return message_id in self._memory
+
+    def get_raw(self, message_id: str) -> tuple[int, bytes] | None:
+        """Return (historyId, raw RFC 2822 bytes) from the disk tier"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT history_id, raw FROM messages WHERE id = ? ORDER BY history_id DESC LIMIT 1',
+                (message_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._clock += 1
+            self._db.execute('UPDATE messages SET used = ? WHERE id = ? AND history_id = ?',
+                             (self._clock, message_id, row[0]))
+            self._db.commit()
+            return row[0], row[1]
+
+    def put_raw(self, message_id: str, history_id: int, raw: bytes) -> None:
+        """Store a raw payload, replacing older versions of the message and evicting
+        least recently used payloads beyond the disk budget"""
+        if len(raw) > self.disk_budget:
+            return
+        with self._lock:
+            self._disk_bytes -= self._db.execute(
+                'SELECT COALESCE(SUM(LENGTH(raw)), 0) FROM messages WHERE id = ? AND history_id <= ?',
+                (message_id, history_id)).fetchone()[0]
+            self._db.execute('DELETE FROM messages WHERE id = ? AND history_id <= ?', (message_id, history_id))
+            self._clock += 1
+            self._db.execute('INSERT INTO messages (id, history_id, raw, used) VALUES (?, ?, ?, ?)',
+                             (message_id, history_id, raw, self._clock))
+            self._disk_bytes += len(raw)
+            self._evict_disk()
+            self._db.commit()
+
+    def _evict_disk(self) -> None:
+        """Delete least recently used payloads until the disk tier fits its budget. Caller holds the lock."""
+        while self._disk_bytes > self.disk_budget:
+            rows = self._db.execute(
+                'SELECT id, history_id, LENGTH(raw) FROM messages ORDER BY used LIMIT 100').fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for message_id, history_id, size in rows:
+                if self._disk_bytes <= self.disk_budget:
+                    break
+                self._db.execute('DELETE FROM messages WHERE id = ? AND history_id = ?', (message_id, history_id))
+                self._disk_bytes -= size
+                self.disk_evictions += 1
+        self._db.commit()
+
+    def put_parsed(self, message_id: str, history_id: int, parsed: dict[str, str]) -> None:
+        """Store a parsed email in the memory tier, evicting least recently used entries"""
+        size = sum(len(value) for value in parsed.values() if isinstance(value, str))
+        if size > self.memory_budget:
+            return
+        with self._lock:
+            previous = self._memory.pop(message_id, None)
+            if previous is not None:
+                self._memory_bytes -= previous[2]
+            self._memory[message_id] = (history_id, dict(parsed), size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_budget:
+                _, (_, _, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, changes: Iterable[tuple[str, int | None]]) -> None:
+        """
+        Drop cached versions of messages older than the historyId given with each ID
+        (all versions if None), committing once for all of them."""
+        with self._lock:
+            for message_id, history_id in changes:
+                removed = False
+                entry = self._memory.get(message_id)
+                if entry is not None and (history_id is None or entry[0] < history_id):
+                    del self._memory[message_id]
+                    self._memory_bytes -= entry[2]
+                    removed = True
+                if history_id is None:
+                    where, params = 'id = ?', (message_id,)
+                else:
+                    where, params = 'id = ? AND history_id < ?', (message_id, history_id)
+                self._disk_bytes -= self._db.execute(
+                    f'SELECT COALESCE(SUM(LENGTH(raw)), 0) FROM messages WHERE {where}', params).fetchone()[0]
+                cursor = self._db.execute(f'DELETE FROM messages WHERE {where}', params)
+                if removed or cursor.rowcount:
+                    self.invalidations += 1
+            self._db.commit()
+
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counters and current memory usage"""
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_evictions': self.disk_evictions,
+                'disk_bytes': self._disk_bytes,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+class MessagePrefetcher:
+    """
+    Reads the newest unread emails ahead of the agent, right after it lists them.
+    fetch(email_ids, max_bytes) returns (historyId, parsed email) keyed by ID, without marking
+    anything read, and skips emails that would not fit in max_bytes before downloading them.
+    Parsed emails wait in memory, within max_bytes, until a read takes them. A new listing
+    cancels a prefetch still running and drops emails the listing no longer starts with."""
+
+    def __init__(self,
+                 fetch: Callable[[list[str], int], Awaitable[dict[str, tuple[int, dict[str, Any]]]]],
+                 count: int = PREFETCH_COUNT,
+                 max_bytes: int = PREFETCH_MEMORY_BYTES):
+        self._fetch = fetch
+        self.count = count
+        self.max_bytes = max_bytes
+        self._store: dict[str, tuple[int, dict[str, Any], int]] = {}
+        self._bytes = 0
+        self._task: asyncio.Task | None = None
+        self.prefetched = 0
+        self.hits = 0
+        self.unused = 0
+        self.cancelled = 0
+
+    def listed(self, email_ids: Iterable[str]) -> None:
+        """Prefetch the first count emails of a new listing, newest first"""
+        if self.count <= 0:
+            return
+        wanted = list(itertools.islice(email_ids, self.count))
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            self.cancelled += 1
+        for email_id in [email_id for email_id in self._store if email_id not in wanted]:
+            self.discard(email_id)
+            self.unused += 1
+        missing = [email_id for email_id in wanted if email_id not in self._store]
+        if missing:
+            self._task = asyncio.create_task(self._run(missing))
+
+    async def _run(self, email_ids: list[str]) -> None:
+        try:
+            fetched = await self._fetch(email_ids, self.max_bytes - self._bytes)
+        except Exception as error:
+            logger.warning(f"Prefetch of {len(email_ids)} emails failed: {error}")
+            return
+        # Newest first, so the budget goes to the emails most likely to be read
+        for email_id in email_ids:
+            if email_id not in fetched:
+                continue
+            history_id, email_metadata = fetched[email_id]
+            size = sum(len(value) for value in email_metadata.values() if isinstance(value, str))
+            if self._bytes + size > self.max_bytes:
+                continue
+            self._store[email_id] = (history_id, email_metadata, size)
+            self._bytes += size
+            self.prefetched += 1
+        logger.info(f"Prefetched {len(fetched)} of {len(email_ids)} unread emails ({self._bytes} bytes held)")
+
+    def take(self, email_id: str) -> tuple[int, dict[str, Any]] | None:
+        """(historyId, parsed email) if it was prefetched, removing it from the store"""
+        entry = self._store.pop(email_id, None)
+        if entry is None:
+            return None
+        self._bytes -= entry[2]
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def discard(self, email_id: str) -> None:
+        entry = self._store.pop(email_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'prefetched': self.prefetched,
+            'hits': self.hits,
+            'unused': self.unused,
+            'cancelled': self.cancelled,
+            'entries': len(self._store),
+            'bytes': self._bytes,
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class AttachmentStore:
+    """
+    Downloaded attachments stored on disk by the SHA-256 of their content.
+    Identical attachments from many messages share one file, and an index in SQLite maps
+    (message ID, part ID) to the file so the same attachment is only downloaded once.
+    Gmail issues a new attachment ID every time a message is fetched, the part ID is stable."""
+
+    def __init__(self, directory: str, db_path: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS attachments ('
+            'message_id TEXT NOT NULL, part_id TEXT NOT NULL, sha256 TEXT NOT NULL, '
+            'size INTEGER NOT NULL, PRIMARY KEY (message_id, part_id))'
+        )
+        self._db.commit()
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def lookup(self, message_id: str, part_id: str) -> dict[str, Any] | None:
+        """Stored file for an attachment downloaded before, if it is still on disk"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT sha256, size FROM attachments WHERE message_id = ? AND part_id = ?',
+                (message_id, part_id)).fetchone()
+        if row is None or not os.path.exists(self.path(row[0])):
+            return None
+        return {'path': self.path(row[0]), 'size': row[1], 'sha256': row[0]}
+
+    def save(self, message_id: str, part_id: str | None, chunks: Iterable[bytes]) -> dict[str, Any]:
+        """
+        Writes chunks to a temporary file while hashing them, then moves it into place.
+        If a file with the same content exists the new copy is discarded.
+        Without a part ID the file is stored but not indexed."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            sha256 = digest.hexdigest()
+            path = self.path(sha256)
+            deduplicated = os.path.exists(path)
+            if deduplicated:
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if part_id is not None:
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO attachments (message_id, part_id, sha256, size) '
+                                 'VALUES (?, ?, ?, ?)', (message_id, part_id, sha256, size))
+                self._db.commit()
+        return {'path': path, 'size': size, 'sha256': sha256, 'deduplicated': deduplicated}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+class SendLog:
+    """
+    Idempotency keys of emails sent by send-bulk-email, stored in SQLite.
+    A key is claimed before its email is sent and given the Gmail message ID once the send
+    succeeds. A key without a message ID is a send whose outcome is unknown, such as one that
+    timed out, and is checked against the Sent folder before it is claimed again.
+    Keys expire after the TTL they were recorded with and are then pruned, so the same email
+    can be sent again later."""
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sent_messages ('
+            'idempotency_key TEXT PRIMARY KEY, recipient TEXT NOT NULL, message_id TEXT, '
+            'created REAL NOT NULL, claimed REAL NOT NULL, expires REAL NOT NULL)'
+        )
+        with self._lock:
+            self._prune()
+
+    def _prune(self) -> None:
+        """Delete expired keys. Caller holds the lock."""
+        self._db.execute('DELETE FROM sent_messages WHERE expires <= ?', (time.time(),))
+        self._db.commit()
+
+    def get(self, key: str) -> tuple[str | None, float, float] | None:
+        """
+        (message ID or None if the outcome is unknown, time recorded, time of the last attempt)
+        for a live key, else None"""
+        with self._lock:
+            return self._db.execute('SELECT message_id, created, claimed FROM sent_messages '
+                                    'WHERE idempotency_key = ? AND expires > ?', (key, time.time())).fetchone()
+
+    def begin(self, key: str, recipient: str, created: float, ttl: float, stale_before: float) -> bool:
+        """
+        Claims a key for sending. Returns False if it was sent, or another attempt claimed it
+        after stale_before and may still be sending."""
+        with self._lock:
+            self._prune()
+            now = time.time()
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO sent_messages (idempotency_key, recipient, created, claimed, expires) '
+                'VALUES (?, ?, ?, ?, ?)', (key, recipient, created, now, created + ttl))
+            if not cursor.rowcount:
+                cursor = self._db.execute(
+                    'UPDATE sent_messages SET claimed = ? WHERE idempotency_key = ? '
+                    'AND message_id IS NULL AND claimed < ?', (now, key, stale_before))
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def complete(self, key: str, message_id: str) -> None:
+        with self._lock:
+            self._db.execute('UPDATE sent_messages SET message_id = ? WHERE idempotency_key = ?',
+                             (message_id, key))
+            self._db.commit()
+
+    def discard(self, key: str) -> None:
+        """Forget a send that Gmail rejected, so it can be tried again"""
+        with self._lock:
+            self._db.execute('DELETE FROM sent_messages WHERE idempotency_key = ?', (key,))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+class EncodedAttachmentCache:
+    """
+    In-memory LRU of base64 encoded attachment files, bounded by a byte budget.
+    Files are looked up by path, modification time and size, and the encoded lines are stored
+    by the SHA-256 of the file content, so sending the same file again needs only a stat()
+    and copies of one file under different paths share an entry."""
+
+    def __init__(self, max_bytes: int = ATTACHMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._files: dict[tuple[str, int, int], str] = {}
+        self._parts: OrderedDict[str, bytes] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: str) -> tuple[str, bytes]:
+        """(SHA-256 of the file content, its base64 lines), reading and encoding the file on a miss"""
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        file_key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            sha256 = self._files.get(file_key)
+            if sha256 in self._parts:
+                self._parts.move_to_end(sha256)
+                self.hits += 1
+                return sha256, self._parts[sha256]
+            self.misses += 1
+
+        digest = hashlib.sha256()
+        chunks = []
+        with open(path, 'rb') as f:
+            while chunk := f.read(ATTACHMENT_READ_SIZE):
+                digest.update(chunk)
+                chunks.append(base64.encodebytes(chunk))
+            changed = os.fstat(f.fileno()).st_mtime_ns != stat.st_mtime_ns
+        sha256 = digest.hexdigest()
+        encoded = b''.join(chunks)
+        # Files written to while being read and files over the budget are not kept
+        if changed or len(encoded) > self.max_bytes:
+            return sha256, encoded
+        with self._lock:
+            self._files[file_key] = sha256
+            if sha256 not in self._parts:
+                self._parts[sha256] = encoded
+                self._bytes += len(encoded)
+            self._parts.move_to_end(sha256)
+            while self._bytes > self.max_bytes:
+                evicted, evicted_part = self._parts.popitem(last=False)
+                self._bytes -= len(evicted_part)
+                self.evictions += 1
+                self._files = {key: value for key, value in self._files.items() if value != evicted}
+            return sha256, self._parts.get(sha256, encoded)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._parts),
+                'bytes': self._bytes,
+            }
+
+def iter_attachment_data(response: bytes) -> Iterator[bytes]:
+    """
+    Decodes the base64url 'data' field of a raw attachments.get JSON response in chunks,
+    without parsing the JSON or holding a second decoded copy of the attachment."""
+    key = response.find(b'"data"')
+    if key == -1:
+        raise ValueError("Attachment response has no data")
+    start = response.index(b'"', response.index(b':', key)) + 1
+    end = response.index(b'"', start)
+    data = memoryview(response)
+    for offset in range(start, end, ATTACHMENT_DECODE_CHUNK):
+        chunk = data[offset:min(offset + ATTACHMENT_DECODE_CHUNK, end)].tobytes()
+        yield base64.urlsafe_b64decode(chunk + b'=' * (-len(chunk) % 4))
+
+class SearchIndex:
+    """
+    Full-text index of emails this server has read, in an SQLite FTS5 table.
+    Messages are added as they are fetched and removed when deleted or trashed, so searches
+    over mail already seen are answered locally without Gmail quota.
+    If SQLite was built without FTS5 the index is disabled and every search goes to Gmail."""
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            self._db.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5('
+                'id UNINDEXED, subject, sender, recipients, date, body, '
+                "tokenize = 'porter unicode61')"
+            )
+            self._db.commit()
+            self.enabled = True
+        except sqlite3.OperationalError as error:
+            logger.info(f"Local search disabled: {error}")
+            self.enabled = False
+
+    def add(self, messages: Iterable[tuple[str, dict[str, Any]]]) -> None:
+        """Index or re-index parsed emails, given as (ID, parsed email) pairs, in one transaction"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for message_id, email_metadata in messages:
+                self._db.execute('DELETE FROM message_index WHERE id = ?', (message_id,))
+                self._db.execute(
+                    'INSERT INTO message_index (id, subject, sender, recipients, date, body) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (message_id, email_metadata.get('subject') or '', email_metadata.get('from') or '',
+                     email_metadata.get('to') or '', email_metadata.get('date') or '',
+                     email_metadata.get('content') or ''))
+            self._db.commit()
+
+    def remove(self, message_ids: Iterable[str]) -> None:
+        """Drop messages from the index in one transaction"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._db.executemany('DELETE FROM message_index WHERE id = ?',
+                                 [(message_id,) for message_id in message_ids])
+            self._db.commit()
+
+    def _query(self, match: str, limit: int) -> list[dict[str, str]]:
+        # bm25 weights follow the column order, subject and sender count the most
+        rows = self._db.execute(
+            'SELECT id, highlight(message_index, 1, \'[\', \']\'), sender, date, '
+            "snippet(message_index, 5, '[', ']', '...', 16) "
+            'FROM message_index WHERE message_index MATCH ? '
+            'ORDER BY bm25(message_index, 0.0, 10.0, 5.0, 5.0, 1.0, 1.0) LIMIT ?',
+            (match, limit)).fetchall()
+        return [{'id': row[0], 'subject': row[1], 'from': row[2], 'date': row[3], 'snippet': row[4]}
+                for row in rows]
+
+    def search(self, query: str, limit: int) -> list[dict[str, str]]:
+        """
+        Ranked matches for an FTS5 query, best first, with matched terms in [brackets].
+        Queries that are not valid FTS5 syntax are searched as plain words instead."""
+        if not self.enabled:
+            return []
+        with self._lock:
+            try:
+                return self._query(query, limit)
+            except sqlite3.OperationalError:
+                words = ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+                return self._query(words, limit) if words else []
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+@functools.cache
+def build_gmail_service(root_url: str | None = None) -> Any:
+    """Gmail API client built once from the bundled discovery document.
+    It holds no credentials, so every account shares it and the executor authorizes each call.
+    root_url points the client at another Gmail-compatible endpoint, such as a local stand-in."""
+    if root_url is None:
+        return build('gmail', 'v1', http=httplib2.Http(), static_discovery=True, cache_discovery=False)
+    document = json.loads(get_static_doc('gmail', 'v1'))
+    document['rootUrl'] = document['mtlsRootUrl'] = root_url
+    return build_from_document(document, http=httplib2.Http())
+
+class GmailService:
+    # (account, idempotency key) of bulk sends running in this process, shared by every session
+    _sends_in_flight: set[tuple[str, str]] = set()
+
+    def __init__(self,
+                 creds_file_path: str,
+                 token_path: str,
+                 scopes: list[str] = ['https://www.googleapis.com/auth/gmail.modify'],
+                 cache_path: str | None = None,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 quota_units_per_second: float = GMAIL_QUOTA_UNITS_PER_SECOND,
+                 sync_state_path: str | None = None,
+                 executor: GoogleApiExecutor | None = None,
+                 api_root_url: str | None = None,
+                 body_max_bytes: int = BODY_MAX_BYTES,
+                 attachment_dir: str | None = None,
+                 attachment_cache_bytes: int = ATTACHMENT_CACHE_BYTES,
+                 message_cache_disk_bytes: int = MESSAGE_CACHE_DISK_BYTES,
+                 prefetch_count: int = PREFETCH_COUNT,
+                 prefetch_bytes: int = PREFETCH_MEMORY_BYTES):
+        logger.info(f"Initializing GmailService with creds file: {creds_file_path}")
+        self.creds_file_path = creds_file_path
+        self.token_path = token_path
+        self.scopes = scopes
+        self.api_root_url = api_root_url
+        self.body_max_bytes = body_max_bytes
+        if cache_path is None:
+            cache_path = os.path.join(os.path.dirname(os.path.abspath(token_path)), 'gmail_cache.sqlite3')
+        self.message_cache = MessageCache(cache_path, disk_budget=message_cache_disk_bytes)
+        logger.info(f"Message cache opened at {cache_path}")
+        self.search_index = SearchIndex(cache_path)
+        if attachment_dir is None:
+            attachment_dir = os.path.join(os.path.dirname(os.path.abspath(token_path)), 'gmail_attachments')
+        self.attachment_store = AttachmentStore(attachment_dir, cache_path)
+        self.send_log = SendLog(cache_path)
+        self.attachment_cache = EncodedAttachmentCache(attachment_cache_bytes)
+        self.prefetcher = MessagePrefetcher(self._prefetch_emails, prefetch_count, prefetch_bytes)
+        if sync_state_path is None:
+            sync_state_path = os.path.join(os.path.dirname(os.path.abspath(token_path)), 'gmail_sync_state.json')
+        self.sync_state_path = sync_state_path
+        self.history_id, self.unread = self._load_sync_state()
+        self._sync_lock = asyncio.Lock()
+        self.mark_read_queue = MarkReadQueue(
+            lambda email_ids: self._modify_labels(email_ids, remove_label_ids=['UNREAD'],
+                                                  priority=PRIORITY_BULK)
+        )
+        self.auth = CredentialManager(creds_file_path, token_path, scopes)
+        # A shared executor belongs to whoever passed it in
+        self._owns_executor = executor is None
+        self.executor = executor or GoogleApiExecutor(max_workers, request_timeout)
+        self.metrics = self.executor.metrics
+        self.scheduler = QuotaScheduler(quota_units_per_second)
+        # Filled in by start() so the MCP handshake never waits on Google
+        self.service = None
+        self.user_email = ''
+        self.startup_timings: dict[str, float] = {}
+        self._startup: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start loading credentials and the Gmail service in the background"""
+        if self._startup is None:
+            self._startup = asyncio.create_task(self._start())
+
+    async def _start(self) -> None:
+        started = time.perf_counter()
+
+        async def timed(name: str, func: Callable[[], T]) -> T:
+            began = time.perf_counter()
+            result = await asyncio.to_thread(func)
+            self.startup_timings[name] = (time.perf_counter() - began) * 1000
+            return result
+
+        # The service is built from the bundled discovery document and needs no credentials
+        _, self.service = await asyncio.gather(
+            timed('credentials_ms', self.auth.load),
+            timed('service_build_ms', self._get_service),
+        )
+        self.auth.start()
+        logger.info("Token retrieved and Gmail service initialized")
+
+        began = time.perf_counter()
+        self.user_email = await self._get_user_email()
+        self.startup_timings['profile_ms'] = (time.perf_counter() - began) * 1000
+        self.startup_timings['ready_ms'] = (time.perf_counter() - started) * 1000
+        self.startup_timings['since_process_start_ms'] = (time.perf_counter() - PROCESS_START) * 1000
+        logger.info(f"User email retrieved: {self.user_email}")
+        logger.info(f"Gmail service ready: " + ", ".join(
+            f"{name}={value:.0f}" for name, value in self.startup_timings.items()))
+
+    async def wait_ready(self) -> None:
+        """Wait for start() to finish, re-raising any startup error.
+        A failed startup is retried by the next caller."""
+        self.start()
+        startup = self._startup
+        try:
+            await asyncio.shield(startup)
+        except Exception:
+            if startup.done() and self._startup is startup:
+                self._startup = None
+            raise
+
     def _get_service(self) -> Any:
-        """Initialize Gmail API service"""
+        """Initialize Gmail API service from the bundled discovery document.
+        Requests are authorized per call by the executor."""
         try:
-            service = build('gmail', 'v1', credentials=self.token)
+            service = build_gmail_service(self.api_root_url)
             return service
         except HttpError as error:
             logger.error(f'An error occurred building Gmail service: {error}')
             raise ValueError(f'An error occurred: {error}')
     
-    def _get_user_email(self) -> str:
+    async def _get_user_email(self) -> str:
         """Get user email address"""
-        profile = self.service.users().getProfile(userId='me').execute()
+        profile = await self._execute(self.service.users().getProfile(userId='me', fields='emailAddress'))
         user_email = profile.get('emailAddress', '')
         return user_email
+
+    async def _execute(self, request: Any, priority: int = PRIORITY_INTERACTIVE) -> Any:
+        """Execute a Gmail API request on the executor, paced by the quota scheduler"""
+        method = getattr(request, 'methodId', None)
+
+        async def call() -> Any:
+            with self.metrics.track_api_call([method]):
+                return await self.executor.execute(request, self.auth.credentials)
+
+        return await self.scheduler.call(
+            call, quota_cost(request), priority,
+            idempotent=getattr(request, 'methodId', None) not in NON_IDEMPOTENT_METHODS,
+        )
+
+    async def _execute_batch(self, requests: dict[str, Any],
+                             priority: int = PRIORITY_INTERACTIVE) -> dict[str, tuple[Any, HttpError | None]]:
+        """Execute requests in Gmail batch calls of at most BATCH_LIMIT sub-requests.
+        Batches run concurrently on the executor, each charged the quota of its sub-requests.
+        Sub-requests that hit rate limits or server errors are retried in later batches.
+        Returns (response, error) keyed by the request IDs given."""
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        async def run_batch(items: list[tuple[str, Any]]) -> None:
+            batch = self.service.new_batch_http_request(callback=callback)
+            for request_id, request in items:
+                batch.add(request, request_id=request_id)
+
+            async def call() -> None:
+                with self.metrics.track_api_call([getattr(request, 'methodId', None) for _, request in items]):
+                    await self.executor.execute(batch, self.auth.credentials)
+
+            await self.scheduler.call(call, sum(quota_cost(request) for _, request in items), priority)
+
+        pending = list(requests.items())
+        for attempt in range(self.scheduler.max_retries + 1):
+            await asyncio.gather(*(run_batch(pending[start:start + BATCH_LIMIT])
+                                   for start in range(0, len(pending), BATCH_LIMIT)))
+            delays = {}
+            for request_id, request in pending:
+                error = results[request_id][1]
+                if isinstance(error, HttpError) and attempt < self.scheduler.max_retries:
+                    idempotent = getattr(request, 'methodId', None) not in NON_IDEMPOTENT_METHODS
+                    delay = retry_delay(error, attempt, idempotent)
+                    if delay is not None:
+                        delays[request_id] = delay
+            if not delays:
+                break
+            if any(results[request_id][1].resp.status in (403, 429) for request_id in delays):
+                self.scheduler.backoff()
+            self.scheduler.retries += len(delays)
+            logger.warning(f"Retrying {len(delays)} batched requests in {max(delays.values()):.1f}s")
+            await asyncio.sleep(max(delays.values()))
+            pending = [(request_id, request) for request_id, request in pending if request_id in delays]
+        return results
+
+    async def close(self) -> None:
+        """Drain queued work, then release the executor and the message cache"""
+        if self._startup is not None and not self._startup.done():
+            self._startup.cancel()
+        await self.prefetcher.close()
+        await self.mark_read_queue.close()
+        await self.auth.close()
+        if self._owns_executor:
+            self.executor.shutdown()
+        self.message_cache.close()
+        self.search_index.close()
+        self.attachment_store.close()
+        self.send_log.close()
     
     async def send_email(self, recipient_id: str, subject: str, message: str) -> dict:
         """Creates and sends an email message"""
@@ -170,47 +1960,116 @@ class GmailService:
             encoded_message = base64.urlsafe_b64encode(message_obj.as_bytes()).decode()
             create_message = {'raw': encoded_message}
             
-            send_message = await asyncio.to_thread(
-                self.service.users().messages().send(userId="me", body=create_message).execute
+            send_message = await self._execute(
+                self.service.users().messages().send(userId="me", body=create_message)
             )
             logger.info(f"Message sent: {send_message['id']}")
             return {"status": "success", "message_id": send_message["id"]}
         except HttpError as error:
             return {"status": "error", "error_message": str(error)}
 
+    def _mime_message_around(self, recipient_id: str, subject: str, message: str,
+                             filename: str, message_id: str | None = None) -> tuple[bytes, bytes]:
+        """Renders a multipart email with one base64 attachment, split where the attachment data goes"""
+        marker = f"attachment-{uuid.uuid4().hex}"
+        msg = MIMEMultipart()
+        msg['From'] = self.user_email
+        msg['To'] = recipient_id
+        msg['Subject'] = subject
+        if message_id:
+            msg['Message-ID'] = message_id
+        msg.attach(MIMEText(message, 'plain'))
+
+        part = MIMEBase('application', 'octet-stream')
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header(
+            'Content-Disposition',
+            f'attachment; filename= {filename}'
+        )
+        part.set_payload(marker)
+        msg.attach(part)
+
+        head, tail = msg.as_bytes().split(marker.encode(), 1)
+        return head, tail.removeprefix(b'\n')
+
+    def _write_mime_message(self, out: IO[bytes], recipient_id: str, subject: str,
+                            message: str, attachment_path: str) -> None:
+        """Writes a multipart email with attachment to out.
+        The attachment is base64 encoded one chunk at a time, so memory use does not grow with file size."""
+        head, tail = self._mime_message_around(recipient_id, subject, message,
+                                               os.path.basename(attachment_path))
+        # Render everything around the attachment, then stream its data in place of the marker
+        out.write(head)
+        with open(attachment_path, "rb") as attachment:
+            while chunk := attachment.read(ATTACHMENT_READ_SIZE):
+                out.write(base64.encodebytes(chunk))
+        out.write(tail)
+
+    def _upload_message(self, http: Any, mime_file: IO[bytes]) -> dict:
+        """Sends a message/rfc822 file through the resumable media upload endpoint.
+        Transient failures resume from the last chunk Gmail acknowledged."""
+        media = MediaIoBaseUpload(mime_file, mimetype='message/rfc822',
+                                  chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        request = self.service.users().messages().send(userId="me", media_body=media)
+        response = None
+        failures = 0
+        while response is None:
+            try:
+                status, response = request.next_chunk(http=http)
+                failures = 0
+                if status:
+                    logger.info(f"Uploaded {int(status.progress() * 100)}% of message")
+            except (HttpError, httplib2.HttpLib2Error, OSError) as error:
+                if isinstance(error, HttpError) and error.resp.status < 500 and error.resp.status != 429:
+                    raise
+                failures += 1
+                if failures > UPLOAD_MAX_RETRIES:
+                    raise
+                delay = 2 ** failures
+                logger.warning(f"Upload interrupted ({error}), resuming in {delay}s")
+                time.sleep(delay)
+        return response
+
+    async def _send_streamed(self, write_message: Callable[[IO[bytes]], None],
+                             priority: int = PRIORITY_INTERACTIVE) -> dict:
+        """Builds the email in a temporary file with write_message and sends it with a resumable upload"""
+        def send(http: Any) -> dict:
+            with tempfile.TemporaryFile() as mime_file:
+                write_message(mime_file)
+                mime_file.seek(0)
+                return self._upload_message(http, mime_file)
+
+        async def call() -> dict:
+            with self.metrics.track_api_call(['gmail.users.messages.send']):
+                return await self.executor.run(send, self.auth.credentials, timeout=UPLOAD_TIMEOUT)
+
+        return await self.scheduler.call(call, QUOTA_COSTS['gmail.users.messages.send'], priority,
+                                         idempotent=False)
+
     async def send_email_with_attachment(self, recipient_id: str, subject: str, 
                                        message: str, attachment_path: str = None) -> dict:
-        """Send email with optional attachment"""
+        """Send email with optional attachment.
+        Large attachments are streamed with a resumable upload instead of one JSON body."""
         try:
             logger.info(f"Attempting to send email to {recipient_id} with attachment: {attachment_path}")
             if attachment_path and os.path.exists(attachment_path):
                 file_size = os.path.getsize(attachment_path)
                 logger.info(f"Attachment file exists: {attachment_path} (size: {file_size} bytes)")
+
+                if file_size > RESUMABLE_UPLOAD_THRESHOLD:
+                    logger.info(f"Streaming email with large attachment to {recipient_id}")
+                    send_message = await self._send_streamed(lambda out: self._write_mime_message(
+                        out, recipient_id, subject, message, attachment_path))
+                    logger.info(f"Email sent successfully: {send_message['id']}")
+                    return {"status": "success", "message_id": send_message["id"]}
                 
-                # Create multipart message
-                msg = MIMEMultipart()
-                msg['From'] = self.user_email
-                msg['To'] = recipient_id
-                msg['Subject'] = subject
-                
-                # Add body
-                msg.attach(MIMEText(message, 'plain'))
-                
-                # Add attachment
-                with open(attachment_path, "rb") as attachment:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment.read())
-                
-                encoders.encode_base64(part)
-                filename = os.path.basename(attachment_path)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename= {filename}'
-                )
-                msg.attach(part)
+                # Encoded attachments are cached, so sending the same file again skips reading and encoding it
+                _, encoded = await asyncio.to_thread(self.attachment_cache.get, attachment_path)
+                head, tail = self._mime_message_around(recipient_id, subject, message,
+                                                       os.path.basename(attachment_path))
                 
                 # Encode message
-                encoded_message = base64.urlsafe_b64encode(msg.as_bytes()).decode()
+                encoded_message = base64.urlsafe_b64encode(b''.join((head, encoded, tail))).decode()
                 logger.info(f"Email with attachment prepared for {recipient_id}")
             else:
                 if attachment_path:
@@ -227,8 +2086,8 @@ class GmailService:
                 encoded_message = base64.urlsafe_b64encode(message_obj.as_bytes()).decode()
             
             create_message = {'raw': encoded_message}
-            send_message = await asyncio.to_thread(
-                self.service.users().messages().send(userId="me", body=create_message).execute
+            send_message = await self._execute(
+                self.service.users().messages().send(userId="me", body=create_message)
             )
             
             logger.info(f"Email sent successfully: {send_message['id']}")
@@ -237,6 +2096,134 @@ class GmailService:
             logger.error(f"Error sending email: {error}")
             return {"status": "error", "error_message": str(error)}
 
+    async def _find_sent(self, message_id: str) -> str | None:
+        """Gmail ID of a message already in the mailbox with this Message-ID header"""
+        response = await self._execute(self.service.users().messages().list(
+            userId='me', q=f"rfc822msgid:{message_id.strip('<>')}", includeSpamTrash=True,
+            fields='messages(id)'), PRIORITY_BULK)
+        messages = response.get('messages') or []
+        return messages[0]['id'] if messages else None
+
+    async def _send_merged(self, recipient_id: str, subject: str, message: str, message_id: str,
+                           attachment: tuple[str, bytes, int] | None) -> dict:
+        """Sends one mail-merge email. attachment is (filename, base64 lines, file size)
+        and its encoded data is shared by every email of the merge."""
+        if attachment is None:
+            message_obj = EmailMessage()
+            message_obj.set_content(message)
+            message_obj['To'] = recipient_id
+            message_obj['From'] = self.user_email
+            message_obj['Subject'] = subject
+            message_obj['Message-ID'] = message_id
+            data = message_obj.as_bytes()
+        else:
+            filename, encoded, file_size = attachment
+            head, tail = self._mime_message_around(recipient_id, subject, message, filename, message_id)
+            if file_size > RESUMABLE_UPLOAD_THRESHOLD:
+                def write_message(out: IO[bytes]) -> None:
+                    out.write(head)
+                    out.write(encoded)
+                    out.write(tail)
+                return await self._send_streamed(write_message, PRIORITY_BULK)
+            data = b''.join((head, encoded, tail))
+        return await self._execute(self.service.users().messages().send(
+            userId="me", body={'raw': base64.urlsafe_b64encode(data).decode()}), PRIORITY_BULK)
+
+    async def send_bulk_email(self, subject: str, message: str, recipients: list[str | dict[str, Any]],
+                              attachment_path: str | None = None, key: str | None = None,
+                              concurrency: int = BULK_SEND_CONCURRENCY) -> list[dict[str, Any]] | str:
+        """
+        Sends one email per recipient from a subject and message template with {{field}} placeholders.
+        A recipient is an address or an object with an 'email' and its merge fields.
+        Sends run concurrently, at most concurrency at a time, paced by the quota scheduler.
+        Every email gets an idempotency key derived from key (by default the templates and
+        attachment) and the recipient, recorded in the send log and used in its Message-ID,
+        so repeating a call only sends the emails that did not go out the first time.
+        A send that timed out is reported pending for BULK_SEND_PENDING_TIMEOUT instead of
+        being sent again, it may still go out.
+        A derived key is remembered for BULK_SEND_DEFAULT_KEY_TTL, an explicit one for
+        BULK_SEND_KEY_TTL, after which the same emails are sent again.
+        Returns the outcome for each recipient."""
+        if len(recipients) > BULK_SEND_MAX_RECIPIENTS:
+            return f"Too many recipients: at most {BULK_SEND_MAX_RECIPIENTS} per call"
+        attachment = None
+        attachment_digest = ''
+        if attachment_path:
+            if not os.path.exists(attachment_path):
+                return f"Attachment file does not exist: {attachment_path}"
+
+            # Encoded once, every email of the merge reuses the same base64 lines
+            attachment_digest, encoded = await asyncio.to_thread(self.attachment_cache.get, attachment_path)
+            attachment = (os.path.basename(attachment_path), encoded, os.path.getsize(attachment_path))
+        ttl = BULK_SEND_KEY_TTL
+        if key is None:
+            key = idempotency_key(subject, message, attachment_digest)
+            ttl = BULK_SEND_DEFAULT_KEY_TTL
+        domain = self.user_email.rpartition('@')[2] or 'localhost'
+        semaphore = asyncio.Semaphore(max(1, min(concurrency, BULK_SEND_MAX_CONCURRENCY)))
+        seen = set()
+
+        async def send_one(recipient: str | dict[str, Any]) -> dict[str, Any]:
+            fields = {'email': recipient} if isinstance(recipient, str) else recipient
+            recipient_id = fields.get('email')
+            if not recipient_id:
+                return {'recipient': recipient_id, 'status': 'error', 'error_message': "Missing email"}
+            send_key = idempotency_key(key, json.dumps(fields, sort_keys=True, default=str))
+            if send_key in seen:
+                return {'recipient': recipient_id, 'status': 'duplicate'}
+            seen.add(send_key)
+            result = {'recipient': recipient_id, 'idempotency_key': send_key}
+            in_flight = (self.user_email, send_key)
+            async with semaphore:
+                if in_flight in self._sends_in_flight:
+                    return {**result, 'status': 'pending'}
+                self._sends_in_flight.add(in_flight)
+                try:
+                    logged = await asyncio.to_thread(self.send_log.get, send_key)
+                    created = time.time() if logged is None else logged[1]
+                    # Retries of one send share its Message-ID, a send after the key expired gets a new one
+                    message_id = f"<{send_key}.{int(created)}@{domain}>"
+                    stale_before = time.time() - BULK_SEND_PENDING_TIMEOUT
+                    if logged is not None and logged[0] is None:
+                        if logged[2] >= stale_before:
+                            # A timed out send may still be running, or not be searchable yet
+                            return {**result, 'status': 'pending'}
+                        # An earlier send ended without an answer, it may have gone out anyway
+                        found = await self._find_sent(message_id)
+                        if found:
+                            await asyncio.to_thread(self.send_log.complete, send_key, found)
+                            logged = (found, created, logged[2])
+                    if logged is not None and logged[0] is not None:
+                        return {**result, 'status': 'already_sent', 'message_id': logged[0]}
+
+                    merged_subject = render_template(subject, fields)
+                    merged_message = render_template(message, fields)
+                    if not await asyncio.to_thread(self.send_log.begin, send_key, recipient_id,
+                                                   created, ttl, stale_before):
+                        # Another process claimed it between the lookup and now
+                        return {**result, 'status': 'pending'}
+                    try:
+                        sent = await self._send_merged(recipient_id, merged_subject, merged_message,
+                                                       message_id, attachment)
+                    except HttpError as error:
+                        if error.resp.status < 500:
+                            # Rejected, so it was not sent and a later call may try again
+                            await asyncio.to_thread(self.send_log.discard, send_key)
+                        raise
+                    await asyncio.to_thread(self.send_log.complete, send_key, sent['id'])
+                    return {**result, 'status': 'success', 'message_id': sent['id']}
+                except Exception as error:
+                    return {**result, 'status': 'error', 'error_message': str(error)}
+                finally:
+                    self._sends_in_flight.discard(in_flight)
+
+        results = await asyncio.gather(*(send_one(recipient) for recipient in recipients))
+        logger.info(f"Mail merge {key}: sent {sum(r['status'] == 'success' for r in results)}, "
+                    f"already sent {sum(r['status'] == 'already_sent' for r in results)}, "
+                    f"pending {sum(r['status'] == 'pending' for r in results)}, "
+                    f"failed {sum(r['status'] == 'error' for r in results)} of {len(results)}")
+        return list(results)
+
     async def open_email(self, email_id: str) -> str:
         """Opens email in browser given ID."""
         try:
@@ -246,75 +2233,500 @@ class GmailService:
         except HttpError as error:
             return f"An HttpError occurred: {str(error)}"
 
+    def _load_sync_state(self) -> tuple[str | None, OrderedDict[str, str]]:
+        """Load the last seen historyId and unread set saved next to the token file"""
+        unread = OrderedDict()
+        if not os.path.exists(self.sync_state_path):
+            return None, unread
+        try:
+            with open(self.sync_state_path) as state_file:
+                state = json.load(state_file)
+            for message in state.get('unread', []):
+                unread[message['id']] = message['threadId']
+            logger.info(f"Loaded sync state at historyId {state.get('history_id')}")
+            return state.get('history_id'), unread
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning(f"Ignoring unreadable sync state {self.sync_state_path}: {error}")
+            return None, OrderedDict()
+
+    def _save_sync_state(self) -> None:
+        """Atomically persist the historyId and unread set"""
+        state = {
+            'history_id': self.history_id,
+            'unread': [{'id': id, 'threadId': thread_id} for id, thread_id in self.unread.items()],
+        }
+        tmp_path = f"{self.sync_state_path}.tmp"
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self.sync_state_path)
+
+    def _apply_message_labels(self, message: dict) -> None:
+        """Add or remove a message from the unread set based on its current labels"""
+        if UNREAD_LABELS.issubset(message.get('labelIds', [])):
+            if message['id'] not in self.unread:
+                self.unread[message['id']] = message.get('threadId', '')
+                self.unread.move_to_end(message['id'], last=False)
+        else:
+            self.unread.pop(message['id'], None)
+
+    async def _full_unread_sync(self) -> None:
+        """Rebuild the unread set from the full unread query"""
+        user_id = 'me'
+        # Take the historyId before listing so no change falls between the two
+        profile = await self._execute(self.service.users().getProfile(userId=user_id, fields='historyId'))
+
+        response = await self._execute(self.service.users().messages().list(userId=user_id,
+                                                                            q=UNREAD_QUERY))
+        messages = []
+        if 'messages' in response:
+            messages.extend(response['messages'])
+
+        while 'nextPageToken' in response:
+            page_token = response['nextPageToken']
+            response = await self._execute(self.service.users().messages().list(userId=user_id, q=UNREAD_QUERY,
+                                                                                pageToken=page_token))
+            messages.extend(response.get('messages', []))
+
+        self.unread = OrderedDict((message['id'], message['threadId']) for message in messages)
+        self.history_id = profile['historyId']
+        logger.info(f"Full unread sync: {len(self.unread)} messages at historyId {self.history_id}")
+
+    async def _apply_history(self) -> None:
+        """
+        Apply history records since the last seen historyId to the unread set.
+        Cache and index updates are collected and written in one transaction off the event loop."""
+        page_token = None
+        changes = 0
+        invalidated = []
+        deleted = []
+        while True:
+            response = await self._execute(self.service.users().history().list(
+                userId='me', startHistoryId=self.history_id,
+                historyTypes=HISTORY_TYPES, pageToken=page_token))
+
+            for record in response.get('history', []):
+                record_id = int(record['id'])
+                for change in record.get('messagesAdded', []):
+                    self._apply_message_labels(change['message'])
+                    invalidated.append((change['message']['id'], record_id))
+                for change in record.get('messagesDeleted', []):
+                    self.unread.pop(change['message']['id'], None)
+                    invalidated.append((change['message']['id'], None))
+                    deleted.append(change['message']['id'])
+                    self.prefetcher.discard(change['message']['id'])
+                # Label changes leave the cached payload valid, raw content is immutable
+                for change in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    self._apply_message_labels(change['message'])
+                changes += 1
+
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        if invalidated:
+            await asyncio.to_thread(self.message_cache.invalidate, invalidated)
+        if deleted:
+            await asyncio.to_thread(self.search_index.remove, deleted)
+        self.history_id = response.get('historyId', self.history_id)
+        logger.info(f"Applied {changes} history records, now at historyId {self.history_id}")
+
+    async def sync_unread(self) -> None:
+        """Bring the unread set up to date with the mailbox"""
+        async with self._sync_lock:
+            if self.history_id is None:
+                await self._full_unread_sync()
+            else:
+                try:
+                    await self._apply_history()
+                except HttpError as error:
+                    if error.resp.status != 404:
+                        raise
+                    logger.info(f"History ID {self.history_id} expired, running full resync")
+                    await self._full_unread_sync()
+            self._save_sync_state()
+
     async def get_unread_emails(self) -> list[dict[str, str]]| str:
         """
         Retrieves unread messages from mailbox.
-        Returns list of messsage IDs in key 'id'."""
+        Returns list of messsage IDs in key 'id'.
+        Only changes since the last call are fetched, using the Gmail history API."""
         try:
-            user_id = 'me'
-            query = 'in:inbox is:unread category:primary'
-
-            response = self.service.users().messages().list(userId=user_id,
-                                                        q=query).execute()
-            messages = []
-            if 'messages' in response:
-                messages.extend(response['messages'])
-
-            while 'nextPageToken' in response:
-                page_token = response['nextPageToken']
-                response = self.service.users().messages().list(userId=user_id, q=query,
-                                                    pageToken=page_token).execute()
-                messages.extend(response['messages'])
-            return messages
+            await self.sync_unread()
+            self.prefetcher.listed(self.unread)
+            return [{'id': id, 'threadId': thread_id} for id, thread_id in self.unread.items()]
+
+        except HttpError as error:
+            return f"An HttpError occurred: {str(error)}"
 
+    async def get_unread_emails_page(self, max_results: int,
+                                     page_token: str | None = None) -> dict[str, Any] | str:
+        """
+        Retrieves one page of unread messages.
+        Returns message IDs in key 'messages' and a cursor for the next page in 'next_page_token'."""
+        max_results = max(1, min(max_results, MAX_PAGE_SIZE))
+        params = {'userId': 'me', 'q': UNREAD_QUERY, 'maxResults': max_results,
+                  'fields': UNREAD_PAGE_FIELDS}
+        if page_token:
+            params['pageToken'] = decode_page_token(UNREAD_QUERY, page_token)
+        try:
+            response = await self._execute(self.service.users().messages().list(**params))
+            self.prefetcher.listed(message['id'] for message in response.get('messages', []))
+            next_page_token = response.get('nextPageToken')
+            return {
+                'messages': response.get('messages', []),
+                'next_page_token': encode_page_token(UNREAD_QUERY, next_page_token) if next_page_token else None,
+                'result_size_estimate': response.get('resultSizeEstimate', 0),
+            }
         except HttpError as error:
             return f"An HttpError occurred: {str(error)}"
 
-    async def read_email(self, email_id: str) -> dict[str, str]| str:
-        """Retrieves email contents including to, from, subject, and contents."""
+    async def get_email_summaries(self, email_ids: list[str]) -> list[dict[str, str]] | str:
+        """
+        Retrieves From, Subject, Date and snippet for many messages at once.
+        Uses batched metadata requests instead of one full read per message."""
         try:
-            msg = self.service.users().messages().get(userId="me", id=email_id, format='raw').execute()
-            email_metadata = {}
-
-            # Decode the base64URL encoded raw content
-            raw_data = msg['raw']
-            decoded_data = urlsafe_b64decode(raw_data)
-
-            # Parse the RFC 2822 email
-            mime_message = message_from_bytes(decoded_data)
-
-            # Extract the email body
-            body = None
-            if mime_message.is_multipart():
-                for part in mime_message.walk():
-                    # Extract the text/plain part
-                    if part.get_content_type() == "text/plain":
-                        body = part.get_payload(decode=True).decode()
-                        break
+            messages = self.service.users().messages()
+            requests = {
+                email_id: messages.get(userId='me', id=email_id, format='metadata',
+                                       metadataHeaders=SUMMARY_HEADERS,
+                                       fields='id,threadId,snippet,payload/headers')
+                for email_id in dict.fromkeys(email_ids)
+            }
+            results = await self._execute_batch(requests)
+
+            summaries = []
+            for email_id in email_ids:
+                msg, error = results.get(email_id, (None, None))
+                if error is not None or msg is None:
+                    summaries.append({'id': email_id, 'error': str(error)})
+                    continue
+                headers = payload_headers(msg.get('payload', {}))
+                summaries.append({
+                    'id': msg['id'],
+                    'threadId': msg.get('threadId', ''),
+                    'from': headers.get('from', ''),
+                    'subject': decode_mime_header(headers.get('subject', '')),
+                    'date': headers.get('date', ''),
+                    'snippet': html.unescape(msg.get('snippet', '')),
+                })
+            logger.info(f"Retrieved summaries for {len(summaries)} emails")
+            return summaries
+
+        except HttpError as error:
+            return f"An HttpError occurred: {str(error)}"
+
+    async def search_emails(self, query: str, max_results: int = 20,
+                            remote: bool = False) -> list[dict[str, str]] | str:
+        """
+        Searches emails already read by this server in the local full-text index.
+        Results are ranked best first with matched terms in [brackets] and cost no quota.
+        With remote, Gmail's own search (q=) fills up the results when the index has too few."""
+        start = time.perf_counter()
+        results = await asyncio.to_thread(self.search_index.search, query, max_results)
+        for result in results:
+            result['source'] = 'local'
+        logger.info(f"Local search found {len(results)} emails in {(time.perf_counter() - start) * 1000:.1f} ms")
+        if not remote or len(results) >= max_results:
+            return results
+
+        try:
+            response = await self._execute(self.service.users().messages().list(
+                userId='me', q=query, maxResults=min(max_results, MAX_PAGE_SIZE), fields='messages/id'))
+            seen = {result['id'] for result in results}
+            remote_ids = [m['id'] for m in response.get('messages', []) if m['id'] not in seen]
+            remote_ids = remote_ids[:max_results - len(results)]
+            if remote_ids:
+                summaries = await self.get_email_summaries(remote_ids)
+                if isinstance(summaries, str):
+                    return summaries
+                for summary in summaries:
+                    summary['source'] = 'remote'
+                results.extend(summaries)
+            return results
+        except HttpError as error:
+            return f"An HttpError occurred: {str(error)}"
+
+    def _parse_email(self, raw: bytes) -> dict[str, str]:
+        """Parses an RFC 2822 email into content, subject, from, to and date.
+        The body is decoded up to body_max_bytes, content_truncated is set if it was cut."""
+        email_metadata = {}
+
+        # Parse the RFC 2822 headers
+        mime_message, _ = parse_header_block(raw, 0, len(raw))
+
+        # Extract the email body
+        body, truncated = message_body(raw, self.body_max_bytes)
+        email_metadata['content'] = body
+        if truncated:
+            email_metadata['content_truncated'] = True
+        
+        # Extract metadata
+        email_metadata['subject'] = decode_mime_header(mime_message.get('subject', ''))
+        email_metadata['from'] = mime_message.get('from','')
+        email_metadata['to'] = mime_message.get('to','')
+        email_metadata['date'] = mime_message.get('date','')
+        return email_metadata
+
+    async def _read_raw(self, email_id: str) -> dict[str, str]:
+        """Downloads and parses the full raw email, using the message cache"""
+        email_metadata = self.message_cache.get_parsed(email_id)
+        if email_metadata is None and (prefetched := self.prefetcher.take(email_id)) is not None:
+            history_id, email_metadata = prefetched
+            self.message_cache.put_parsed(email_id, history_id, email_metadata)
+            await asyncio.to_thread(self.search_index.add, [(email_id, email_metadata)])
+        if email_metadata is None:
+            cached = await asyncio.to_thread(self.message_cache.get_raw, email_id)
+            if cached is None:
+                msg = await self._execute(
+                    self.service.users().messages().get(userId="me", id=email_id, format='raw'))
+                # Decode the base64URL encoded raw content
+                history_id = int(msg['historyId'])
+                raw_data = urlsafe_b64decode(msg['raw'])
+                await asyncio.to_thread(self.message_cache.put_raw, email_id, history_id, raw_data)
             else:
-                # For non-multipart messages
-                body = mime_message.get_payload(decode=True).decode()
-            email_metadata['content'] = body
-            
-            # Extract metadata
-            email_metadata['subject'] = decode_mime_header(mime_message.get('subject', ''))
-            email_metadata['from'] = mime_message.get('from','')
-            email_metadata['to'] = mime_message.get('to','')
-            email_metadata['date'] = mime_message.get('date','')
+                history_id, raw_data = cached
+
+            # Parsing a large message would otherwise stall every other tool call
+            email_metadata = await asyncio.to_thread(self._parse_email, raw_data)
+            self.message_cache.put_parsed(email_id, history_id, email_metadata)
+            await asyncio.to_thread(self.search_index.add, [(email_id, email_metadata)])
+        return email_metadata
+
+    async def _prefetch_emails(self, email_ids: list[str], max_bytes: int) -> dict[str, tuple[int, dict[str, str]]]:
+        """
+        Downloads and parses emails for the prefetcher in one batch, without marking them read.
+        Emails already parsed in the message cache are skipped. Sizes are looked up first and,
+        newest first, only emails whose sizeEstimate fits in max_bytes are downloaded, so large
+        attachments are not pulled into memory just to keep their text."""
+        messages = self.service.users().messages()
+        email_ids = [email_id for email_id in email_ids if not self.message_cache.has_parsed(email_id)]
+        sizes = await self._execute_batch({
+            email_id: messages.get(userId="me", id=email_id, format='minimal', fields='sizeEstimate')
+            for email_id in email_ids
+        }, PRIORITY_BULK)
+        selected = []
+        for email_id in email_ids:
+            msg, error = sizes[email_id]
+            if error is None and msg.get('sizeEstimate', 0) <= max_bytes:
+                selected.append(email_id)
+                max_bytes -= msg.get('sizeEstimate', 0)
+        if not selected:
+            return {}
+        outcomes = await self._execute_batch({
+            email_id: messages.get(userId="me", id=email_id, format='raw', fields='historyId,raw')
+            for email_id in selected
+        }, PRIORITY_BULK)
+        fetched = {}
+        for email_id, (msg, error) in outcomes.items():
+            if error is None:
+                fetched[email_id] = (int(msg['historyId']),
+                                     await asyncio.to_thread(self._parse_email, urlsafe_b64decode(msg['raw'])))
+        return fetched
+
+    async def _read_headers(self, email_id: str) -> dict[str, str]:
+        """Fetches only the headers and snippet of an email"""
+        msg = await self._execute(self.service.users().messages().get(
+            userId="me", id=email_id, format='metadata', metadataHeaders=READ_HEADERS,
+            fields='id,threadId,snippet,payload/headers'))
+        headers = payload_headers(msg.get('payload', {}))
+        return {
+            'subject': decode_mime_header(headers.get('subject', '')),
+            'from': headers.get('from', ''),
+            'to': headers.get('to', ''),
+            'date': headers.get('date', ''),
+            'snippet': html.unescape(msg.get('snippet', '')),
+        }
+
+    async def _read_text(self, email_id: str) -> dict[str, Any]:
+        """Fetches headers and the text body without downloading attachment data.
+        Attachments are listed with their IDs so they can be fetched on demand."""
+        msg = await self._execute(self.service.users().messages().get(
+            userId="me", id=email_id, format='full', fields=FULL_MESSAGE_FIELDS))
+        email_metadata = await self._message_text(msg)
+        await asyncio.to_thread(self.search_index.add, [(email_id, email_metadata)])
+        return email_metadata
+
+    async def _message_text(self, msg: dict) -> dict[str, Any]:
+        """Headers, text body and attachment list of a message fetched in format=full"""
+        email_id = msg['id']
+        payload = msg.get('payload', {})
+        headers = payload_headers(payload)
+
+        text_parts = {}
+        attachments = []
+        for part in walk_payload(payload):
+            part_body = part.get('body', {})
+            if part.get('filename'):
+                attachments.append({
+                    'filename': part['filename'],
+                    'mime_type': part.get('mimeType', ''),
+                    'size': part_body.get('size', 0),
+                    'part_id': part.get('partId', ''),
+                    'attachment_id': part_body.get('attachmentId', ''),
+                })
+            elif part.get('mimeType') in ('text/plain', 'text/html'):
+                text_parts.setdefault(part['mimeType'], part)
+
+        # HTML is only converted when there is no plain text alternative
+        body = None
+        truncated = False
+        part = text_parts.get('text/plain') or text_parts.get('text/html')
+        if part is not None:
+            part_body = part.get('body', {})
+            if 'data' in part_body:
+                # Only the base64 needed for body_max_bytes is decoded
+                encoded = part_body['data'][:(self.body_max_bytes // 3 + 1) * 4]
+                data = urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            elif 'attachmentId' in part_body:
+                # Gmail leaves very large text parts out of the message resource
+                data = await self.get_attachment(email_id, part_body['attachmentId'])
+            else:
+                data = b''
+            truncated = len(data) > self.body_max_bytes
+            charset = header_charset(payload_headers(part).get('content-type', ''))
+            body = decode_text(data[:self.body_max_bytes], charset, final=not truncated)
+            if part['mimeType'] == 'text/html':
+                body = html_to_text(body)
+
+        email_metadata = {
+            'content': body,
+            'subject': decode_mime_header(headers.get('subject', '')),
+            'from': headers.get('from', ''),
+            'to': headers.get('to', ''),
+            'date': headers.get('date', ''),
+            'attachments': attachments,
+        }
+        if truncated:
+            email_metadata['content_truncated'] = True
+        return email_metadata
+
+    async def get_attachment(self, email_id: str, attachment_id: str) -> bytes:
+        """Downloads one attachment body with users.messages.attachments.get"""
+        attachment = await self._execute(self.service.users().messages().attachments().get(
+            userId="me", messageId=email_id, id=attachment_id))
+        return urlsafe_b64decode(attachment['data'])
+
+    async def download_attachment(self, email_id: str, part_id: str | None = None,
+                                  attachment_id: str | None = None) -> dict[str, Any] | str:
+        """
+        Saves an attachment to the attachment store and returns its local path and size.
+        Attachments are identified by part ID, which is stable, and served from the store
+        without calling Gmail when downloaded before. Without an attachment ID the current
+        one is looked up from the message. The whole JSON response is held in memory and
+        its base64 data decoded to disk in chunks, without a second decoded copy."""
+        if part_id is not None:
+            stored = await asyncio.to_thread(self.attachment_store.lookup, email_id, part_id)
+            if stored is not None:
+                logger.info(f"Attachment already stored: {stored['path']}")
+                return {**stored, 'deduplicated': True}
+        try:
+            if attachment_id is None:
+                msg = await self._execute(self.service.users().messages().get(
+                    userId="me", id=email_id, format='full', fields=f'payload({payload_fields()})'))
+                part = next((part for part in walk_payload(msg.get('payload', {}))
+                             if part.get('partId') == part_id), None)
+                if part is None:
+                    raise ValueError(f"Email {email_id} has no part {part_id}")
+                attachment_id = part.get('body', {}).get('attachmentId')
+                if attachment_id is None:
+                    # Small attachments come inline with the message
+                    data = part.get('body', {}).get('data', '')
+                    stored = await asyncio.to_thread(self.attachment_store.save, email_id, part_id,
+                                                     [urlsafe_b64decode(data + '=' * (-len(data) % 4))])
+                    logger.info(f"Attachment saved: {stored['path']} ({stored['size']} bytes)")
+                    return stored
+            request = self.service.users().messages().attachments().get(
+                userId="me", messageId=email_id, id=attachment_id, fields='data')
+            # Keep the response as bytes instead of parsing the JSON into a string
+            request.postproc = lambda resp, content: content
+            response = await self._execute(request)
+            stored = await asyncio.to_thread(
+                self.attachment_store.save, email_id, part_id, iter_attachment_data(response))
+            logger.info(f"Attachment saved: {stored['path']} ({stored['size']} bytes)")
+            return stored
+        except HttpError as error:
+            return f"An HttpError occurred: {str(error)}"
+
+    async def read_email_body(self, email_id: str, mode: str, offset: int) -> dict[str, Any] | str:
+        """
+        Body of an email from offset bytes into its UTF-8 encoding, to continue a truncated read.
+        mode is the read mode of the truncated response, 'thread' for bodies cut by read-thread."""
+        if mode not in ('raw', 'text', 'thread'):
+            raise ValueError(f"Unknown read mode: {mode}")
+        try:
+            email_metadata = await (self._read_raw(email_id) if mode == 'raw' else self._read_text(email_id))
+        except HttpError as error:
+            return f"An HttpError occurred: {str(error)}"
+        content = email_metadata.get('content') or ''
+        if mode == 'thread':
+            content = strip_quoted_reply(content)
+        body = content.encode()
+        return {
+            'id': email_id,
+            'offset': offset,
+            'content': body[offset:].decode(errors='replace'),
+            'content_bytes': len(body),
+        }
+
+    async def read_email(self, email_id: str, mode: str = 'raw') -> dict[str, Any]| str:
+        """Retrieves email contents including to, from, subject, and contents.
+        mode 'raw' downloads the whole message and is served from the message cache when possible,
+        'text' skips attachment data, and 'headers' returns headers and snippet only."""
+        if mode not in READ_MODES:
+            raise ValueError(f"Unknown read mode: {mode}")
+        try:
+            if mode == 'headers':
+                email_metadata = await self._read_headers(email_id)
+            elif mode == 'text':
+                email_metadata = await self._read_text(email_id)
+            else:
+                email_metadata = await self._read_raw(email_id)
             
-            logger.info(f"Email read: {email_id}")
+            logger.info(f"Email read ({mode}): {email_id}")
             
-            # We want to mark email as read once we read it
-            await self.mark_email_as_read(email_id)
+            if mode != 'headers':
+                # We want to mark email as read once we read it, without waiting on the round trip
+                self.mark_read_queue.add(email_id)
+                self.unread.pop(email_id, None)
 
             return email_metadata
         except HttpError as error:
             return f"An HttpError occurred: {str(error)}"
         
+    async def read_thread(self, thread_id: str, mark_as_read: bool = True) -> dict[str, Any] | str:
+        """
+        Retrieves a whole conversation with one users.threads.get call.
+        Each message carries only its new content, quoted earlier messages are stripped.
+        Unread messages in the thread are marked as read in one batched call."""
+        try:
+            thread = await self._execute(self.service.users().threads().get(
+                userId="me", id=thread_id, format='full', fields=THREAD_FIELDS))
+            messages = thread.get('messages', [])
+            texts = await asyncio.gather(*(self._message_text(msg) for msg in messages))
+            await asyncio.to_thread(self.search_index.add,
+                                    list(zip((msg['id'] for msg in messages), texts)))
+
+            thread_messages = []
+            for msg, email_metadata in zip(messages, texts):
+                email_metadata = {'id': msg['id'], **email_metadata}
+                email_metadata['content'] = strip_quoted_reply(email_metadata['content'] or '')
+                if not email_metadata['attachments']:
+                    del email_metadata['attachments']
+                thread_messages.append(email_metadata)
+                if mark_as_read and 'UNREAD' in msg.get('labelIds', []):
+                    self.mark_read_queue.add(msg['id'])
+                    self.unread.pop(msg['id'], None)
+
+            logger.info(f"Thread read: {thread_id} ({len(thread_messages)} messages)")
+            return {'thread_id': thread_id, 'messages': thread_messages}
+        except HttpError as error:
+            return f"An HttpError occurred: {str(error)}"
+
     async def trash_email(self, email_id: str) -> str:
         """Moves email to trash given ID."""
         try:
-            self.service.users().messages().trash(userId="me", id=email_id).execute()
+            await self._execute(self.service.users().messages().trash(userId="me", id=email_id))
+            self.unread.pop(email_id, None)
+            await asyncio.to_thread(self.search_index.remove, [email_id])
             logger.info(f"Email moved to trash: {email_id}")
             return "Email moved to trash successfully."
         except HttpError as error:
@@ -323,16 +2735,437 @@ class GmailService:
     async def mark_email_as_read(self, email_id: str) -> str:
         """Marks email as read given ID."""
         try:
-            self.service.users().messages().modify(userId="me", id=email_id, body={'removeLabelIds': ['UNREAD']}).execute()
+            await self._execute(
+                self.service.users().messages().modify(userId="me", id=email_id, body={'removeLabelIds': ['UNREAD']}))
+            self.unread.pop(email_id, None)
             logger.info(f"Email marked as read: {email_id}")
             return "Email marked as read."
         except HttpError as error:
             return f"An HttpError occurred: {str(error)}"
+
+    async def _modify_labels(self, email_ids: list[str], add_label_ids: list[str] | None = None,
+                             remove_label_ids: list[str] | None = None,
+                             priority: int = PRIORITY_INTERACTIVE) -> dict[str, str | None]:
+        """
+        Changes labels on many messages with users.messages.batchModify.
+        batchModify fails as a whole, so a chunk rejected for a bad or missing ID (400/404)
+        is retried as batched per-message modify calls to find out which IDs failed.
+        Throttling and server errors are already retried by the executor and are reported
+        for the whole chunk instead of multiplying the calls.
+        Returns None for each successful ID and the error text otherwise."""
+        body = {}
+        if add_label_ids:
+            body['addLabelIds'] = add_label_ids
+        if remove_label_ids:
+            body['removeLabelIds'] = remove_label_ids
+
+        async def modify_chunk(chunk: list[str]) -> dict[str, str | None]:
+            try:
+                await self._execute(self.service.users().messages().batchModify(
+                    userId='me', body={'ids': chunk, **body}), priority)
+                return dict.fromkeys(chunk)
+            except HttpError as error:
+                if error.resp.status not in (400, 404):
+                    logger.warning(f"batchModify of {len(chunk)} emails failed: {error}")
+                    return dict.fromkeys(chunk, str(error))
+                logger.warning(f"batchModify of {len(chunk)} emails failed, retrying individually: {error}")
+            messages = self.service.users().messages()
+            try:
+                results = await self._execute_batch({
+                    email_id: messages.modify(userId='me', id=email_id, body=body) for email_id in chunk
+                }, priority)
+            except HttpError as error:
+                logger.warning(f"Batched modify of {len(chunk)} emails failed: {error}")
+                return dict.fromkeys(chunk, str(error))
+            return {email_id: None if results[email_id][1] is None else str(results[email_id][1])
+                    for email_id in chunk}
+
+        ids = list(dict.fromkeys(email_ids))
+        outcomes = {}
+        for chunk_result in await asyncio.gather(*(
+            modify_chunk(ids[start:start + BATCH_MODIFY_LIMIT])
+            for start in range(0, len(ids), BATCH_MODIFY_LIMIT)
+        )):
+            outcomes.update(chunk_result)
+        return outcomes
+
+    async def mark_emails_as_read(self, email_ids: list[str]) -> list[dict[str, str]]:
+        """Marks many emails as read. Returns a status for each ID."""
+        outcomes = await self._modify_labels(email_ids, remove_label_ids=['UNREAD'], priority=PRIORITY_BULK)
+        results = []
+        for email_id, error in outcomes.items():
+            if error is None:
+                self.unread.pop(email_id, None)
+                results.append({'id': email_id, 'status': 'success'})
+            else:
+                results.append({'id': email_id, 'status': 'error', 'error_message': error})
+        logger.info(f"Marked {sum(error is None for error in outcomes.values())}/{len(outcomes)} emails as read")
+        return results
+
+    async def trash_emails(self, email_ids: list[str]) -> list[dict[str, str]]:
+        """Moves many emails to trash using batched requests. Returns a status for each ID."""
+        ids = list(dict.fromkeys(email_ids))
+        messages = self.service.users().messages()
+        try:
+            outcomes = await self._execute_batch({
+                email_id: messages.trash(userId='me', id=email_id) for email_id in ids
+            }, PRIORITY_BULK)
+        except HttpError as error:
+            logger.warning(f"Batched trash of {len(ids)} emails failed: {error}")
+            outcomes = dict.fromkeys(ids, (None, error))
+        results = []
+        for email_id in ids:
+            _, error = outcomes[email_id]
+            if error is None:
+                self.unread.pop(email_id, None)
+                results.append({'id': email_id, 'status': 'success'})
+            else:
+                results.append({'id': email_id, 'status': 'error', 'error_message': str(error)})
+        await asyncio.to_thread(self.search_index.remove,
+                                [result['id'] for result in results if result['status'] == 'success'])
+        logger.info(f"Moved {sum(r['status'] == 'success' for r in results)}/{len(results)} emails to trash")
+        return results
   
-async def main(creds_file_path: str, token_path: str):
+class AccountRegistry:
+    """
+    Hosts GmailService instances for many mailboxes in one process.
+    Services are created and started on first use. All of them share one executor, so they
+    share the worker threads and their connections. Accounts idle for idle_timeout seconds,
+    or least recently used beyond max_active, are closed to cap memory."""
+
+    def __init__(self,
+                 accounts: dict[str, dict[str, str]],
+                 default_account: str,
+                 executor: GoogleApiExecutor,
+                 max_active: int = MAX_ACTIVE_ACCOUNTS,
+                 idle_timeout: float = ACCOUNT_IDLE_TIMEOUT,
+                 **service_options: Any):
+        self.accounts = accounts
+        self.default_account = default_account
+        self.executor = executor
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self.service_options = service_options
+        # Loaded services, least recently used first
+        self._services: OrderedDict[str, GmailService] = OrderedDict()
+        self._in_use: dict[str, int] = {}
+        self._last_used: dict[str, float] = {}
+        self._closing: set[asyncio.Task] = set()
+        self._idle_task: asyncio.Task | None = None
+
+    def _resolve(self, account: str | None) -> str:
+        name = account or self.default_account
+        if name not in self.accounts:
+            raise ValueError(f"Unknown account: {name}")
+        return name
+
+    def get(self, account: str | None = None) -> GmailService:
+        """Service for an account, creating and starting it if it is not loaded"""
+        name = self._resolve(account)
+        service = self._services.get(name)
+        if service is None:
+            config = self.accounts[name]
+            service = GmailService(config['creds_file_path'], config['token_path'],
+                                   cache_path=config.get('cache_path'),
+                                   sync_state_path=config.get('sync_state_path'),
+                                   executor=self.executor, **self.service_options)
+            service.start()
+            self._services[name] = service
+            logger.info(f"Account {name} loaded ({len(self._services)} active)")
+            if self._idle_task is None:
+                self._idle_task = asyncio.create_task(self._evict_idle())
+        self._services.move_to_end(name)
+        self._last_used[name] = time.monotonic()
+        self._evict_over_limit()
+        return service
+
+    @contextlib.asynccontextmanager
+    async def use(self, account: str | None = None):
+        """Hold an account's service for the duration of a call so it is not evicted"""
+        name = self._resolve(account)
+        service = self.get(name)
+        self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield service
+        finally:
+            self._in_use[name] -= 1
+            self._last_used[name] = time.monotonic()
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Message cache, attachment cache, prefetch and quota scheduler stats of each loaded account"""
+        return {name: {'cache': service.message_cache.stats(), 'quota': service.scheduler.stats(),
+                       'attachment_cache': service.attachment_cache.stats(),
+                       'prefetch': service.prefetcher.stats()}
+                for name, service in self._services.items()}
+
+    def _evict(self, name: str) -> None:
+        service = self._services.pop(name)
+        logger.info(f"Evicting account {name} ({len(self._services)} active)")
+        task = asyncio.create_task(service.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _evict_over_limit(self) -> None:
+        idle = [name for name in self._services if not self._in_use.get(name)]
+        # The most recently used account is never evicted
+        for name in idle[:max(0, len(self._services) - self.max_active)]:
+            if name != next(reversed(self._services)):
+                self._evict(name)
+
+    async def _evict_idle(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_timeout / 4)
+            now = time.monotonic()
+            for name in list(self._services):
+                if not self._in_use.get(name) and now - self._last_used[name] > self.idle_timeout:
+                    self._evict(name)
+
+    async def close(self) -> None:
+        """Close every loaded account and the shared executor"""
+        if self._idle_task is not None:
+            self._idle_task.cancel()
+        for name in list(self._services):
+            self._evict(name)
+        await asyncio.gather(*self._closing, return_exceptions=True)
+        self.executor.shutdown()
+
+def load_accounts(accounts_file: str | None, creds_file_path: str | None,
+                  token_path: str | None, cache_path: str | None) -> tuple[dict[str, dict[str, str]], str]:
+    """
+    Account configurations keyed by name, and the default account name.
+    --creds-file-path/--token-path give the default account. An accounts file maps further
+    names to objects with creds_file_path, token_path and optionally cache_path."""
+    accounts = {}
+    if creds_file_path and token_path:
+        accounts[DEFAULT_ACCOUNT] = {'creds_file_path': creds_file_path, 'token_path': token_path,
+                                     'cache_path': cache_path}
+    if accounts_file:
+        with open(accounts_file) as f:
+            for name, config in json.load(f).items():
+                state_dir = os.path.dirname(os.path.abspath(config['token_path']))
+                # Accounts sharing a directory must not share cache or sync state files
+                config.setdefault('cache_path', os.path.join(state_dir, f'gmail_cache_{name}.sqlite3'))
+                config.setdefault('sync_state_path', os.path.join(state_dir, f'gmail_sync_state_{name}.json'))
+                accounts[name] = config
+    if not accounts:
+        raise ValueError("Provide --creds-file-path and --token-path, or --accounts-file")
+    default_account = DEFAULT_ACCOUNT if DEFAULT_ACCOUNT in accounts else next(iter(accounts))
+    return accounts, default_account
+
+class GmailMcpServer(Server):
+    """MCP server that advertises resource subscriptions once a subscribe handler is registered.
+    The SDK leaves the capability off regardless."""
+
+    def get_capabilities(self, notification_options: NotificationOptions,
+                         experimental_capabilities: dict[str, dict[str, Any]]) -> types.ServerCapabilities:
+        capabilities = super().get_capabilities(notification_options, experimental_capabilities)
+        if capabilities.resources is not None and types.SubscribeRequest in self.request_handlers:
+            capabilities.resources.subscribe = True
+        return capabilities
+
+async def serve_http(server: Server, host: str, port: int, shutdown_timeout: int) -> None:
+    """
+    Serves MCP over streamable HTTP at HTTP_PATH until interrupted.
+    Every client gets its own session, and all sessions share this process's accounts, executor
+    and caches. On shutdown new connections are refused and requests in flight get
+    shutdown_timeout seconds to finish before they are cancelled."""
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+    # Tool results go back as plain JSON responses, which uvicorn lets finish on shutdown.
+    # SSE is only used for the stream that carries resource notifications.
+    session_manager = StreamableHTTPSessionManager(server, json_response=True)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        async with session_manager.run():
+            logger.info(f"MCP server accepting requests at http://{host}:{port}{HTTP_PATH} "
+                        f"{(time.perf_counter() - PROCESS_START) * 1000:.0f} ms after start")
+            yield
+            logger.info("Draining MCP sessions")
+
+    app = Starlette(routes=[Mount(HTTP_PATH, app=session_manager.handle_request)], lifespan=lifespan)
+    config = uvicorn.Config(app, host=host, port=port, log_config=None,
+                            timeout_graceful_shutdown=shutdown_timeout)
+    # uvicorn re-raises the signal that stopped it once it has shut down. Ignore it then,
+    # so the caller still closes accounts and flushes queued work.
+    handlers = {signum: signal.signal(signum, lambda *_: None) for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        await uvicorn.Server(config).serve()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+async def main(creds_file_path: str | None, token_path: str | None, cache_path: str | None = None,
+               max_workers: int = DEFAULT_MAX_WORKERS, request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+               quota_units_per_second: float = GMAIL_QUOTA_UNITS_PER_SECOND,
+               accounts_file: str | None = None, max_active_accounts: int = MAX_ACTIVE_ACCOUNTS,
+               account_idle_timeout: float = ACCOUNT_IDLE_TIMEOUT,
+               metrics_file: str | None = None, metrics_interval: float = METRICS_DUMP_INTERVAL,
+               max_response_bytes: int = MAX_RESPONSE_BYTES, body_max_bytes: int = BODY_MAX_BYTES,
+               attachment_dir: str | None = None, attachment_cache_bytes: int = ATTACHMENT_CACHE_BYTES,
+               transport: str = 'stdio', host: str = HTTP_HOST, port: int = HTTP_PORT,
+               session_concurrency: int = SESSION_CONCURRENCY, shutdown_timeout: int = SHUTDOWN_TIMEOUT,
+               prefetch_count: int = PREFETCH_COUNT, prefetch_bytes: int = PREFETCH_MEMORY_BYTES,
+               message_cache_disk_bytes: int = MESSAGE_CACHE_DISK_BYTES):
     
-    gmail_service = GmailService(creds_file_path, token_path)
-    server = Server("gmail")
+    accounts, default_account = load_accounts(accounts_file, creds_file_path, token_path, cache_path)
+    metrics = Metrics()
+    registry = AccountRegistry(accounts, default_account, GoogleApiExecutor(max_workers, request_timeout, metrics),
+                               max_active=max_active_accounts, idle_timeout=account_idle_timeout,
+                               quota_units_per_second=quota_units_per_second, body_max_bytes=body_max_bytes,
+                               attachment_dir=attachment_dir, attachment_cache_bytes=attachment_cache_bytes,
+                               prefetch_count=prefetch_count, prefetch_bytes=prefetch_bytes,
+                               message_cache_disk_bytes=message_cache_disk_bytes)
+    # Credentials and profile load in the background while the server answers the handshake
+    registry.get(default_account)
+    server = GmailMcpServer("gmail", version="0.1.0")
+
+    def metrics_snapshot() -> dict[str, Any]:
+        accounts_stats = registry.stats()
+        for stats in accounts_stats.values():
+            cache = stats['cache']
+            lookups = cache['memory_hits'] + cache['disk_hits'] + cache['misses']
+            cache['hit_rate'] = (cache['memory_hits'] + cache['disk_hits']) / lookups if lookups else 0.0
+            attachment_cache = stats['attachment_cache']
+            lookups = attachment_cache['hits'] + attachment_cache['misses']
+            attachment_cache['hit_rate'] = attachment_cache['hits'] / lookups if lookups else 0.0
+        return {**metrics.snapshot(), 'accounts': accounts_stats}
+
+    def write_metrics_file() -> None:
+        """Atomically replace the Prometheus text file"""
+        tmp_path = f"{metrics_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(metrics.prometheus(registry.stats()))
+        os.replace(tmp_path, metrics_file)
+
+    async def dump_metrics() -> None:
+        while True:
+            await asyncio.sleep(metrics_interval)
+            try:
+                write_metrics_file()
+            except OSError as error:
+                logger.warning(f"Could not write metrics to {metrics_file}: {error}")
+
+    session_limits: weakref.WeakKeyDictionary[Any, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+    tool_names: set[str] = set()
+    # Sessions subscribed to each unread resource, the watcher polling each subscribed account
+    # and the unread email IDs subscribers of each account were last told about
+    subscriptions: dict[str, set[Any]] = {}
+    watchers: dict[str, UnreadWatcher] = {}
+    unread_seen: dict[str, list[str]] = {}
+
+    def unread_resource_uri(account: str) -> str:
+        return UNREAD_RESOURCE_URI if account == default_account else f"{UNREAD_RESOURCE_URI}/{account}"
+
+    def unread_resource_account(uri: str) -> str:
+        """Account of an unread resource URI, gmail://unread being the default account"""
+        uri = uri.rstrip('/')
+        if uri == UNREAD_RESOURCE_URI:
+            return default_account
+        account = uri.removeprefix(f"{UNREAD_RESOURCE_URI}/")
+        if account == uri or account not in accounts:
+            raise ValueError(f"Resource not found: {uri}")
+        return account
+
+    def subscribed(account: str) -> bool:
+        return any(sessions for uri, sessions in subscriptions.items()
+                   if unread_resource_account(uri) == account)
+
+    def unwatch_unsubscribed(account: str) -> None:
+        if not subscribed(account) and account in watchers:
+            watchers.pop(account).stop()
+            logger.info(f"Stopped watching unread emails of {account}")
+
+    async def notify_unread(account: str) -> None:
+        """Tell every session subscribed to the account's unread resource that it changed"""
+        # Sessions may subscribe to other URIs while a notification is being sent
+        for uri, sessions in list(subscriptions.items()):
+            if unread_resource_account(uri) != account:
+                continue
+            for session in list(sessions):
+                try:
+                    await session.send_resource_updated(AnyUrl(uri))
+                except Exception as error:
+                    logger.info(f"Dropping unread subscription of a closed session: {error}")
+                    sessions.discard(session)
+        unwatch_unsubscribed(account)
+
+    async def check_unread(account: str) -> bool:
+        """Sync the account's unread set and say whether it differs from what subscribers last saw.
+        Changes made by tool calls count too, since other sessions may be subscribed."""
+        async with registry.use(account) as gmail_service:
+            await gmail_service.wait_ready()
+            await gmail_service.sync_unread()
+            unread = list(gmail_service.unread)
+        # Without a baseline the first sync only sets one
+        changed = account in unread_seen and unread != unread_seen[account]
+        unread_seen[account] = unread
+        return changed
+
+    @server.subscribe_resource()
+    async def subscribe_resource(uri: AnyUrl) -> None:
+        account = unread_resource_account(str(uri))
+        subscriptions.setdefault(str(uri).rstrip('/'), set()).add(server.request_context.session)
+        if account not in watchers or not watchers[account].running:
+            gmail_service = registry.get(account)
+            if gmail_service.history_id is not None:
+                unread_seen[account] = list(gmail_service.unread)
+            else:
+                unread_seen.pop(account, None)
+            watchers[account] = UnreadWatcher(functools.partial(check_unread, account),
+                                              functools.partial(notify_unread, account))
+            watchers[account].start()
+            logger.info(f"Watching unread emails of {account}")
+
+    @server.unsubscribe_resource()
+    async def unsubscribe_resource(uri: AnyUrl) -> None:
+        account = unread_resource_account(str(uri))
+        subscriptions.get(str(uri).rstrip('/'), set()).discard(server.request_context.session)
+        unwatch_unsubscribed(account)
+
+    @server.list_resources()
+    async def list_resources() -> list[types.Resource]:
+        return [
+            types.Resource(
+                uri=METRICS_RESOURCE_URI,
+                name="metrics",
+                description="Per-tool latency, Gmail API calls and quota units per method, bytes transferred, "
+                            "cache hit rates and in-flight requests",
+                mimeType="application/json",
+            )
+        ] + [
+            types.Resource(
+                uri=unread_resource_uri(account),
+                name=f"unread-{account}",
+                description=f"Unread emails in the primary inbox of the {account} account, newest first. "
+                            "Subscribe to be notified when they change instead of polling.",
+                mimeType="application/json",
+            )
+            for account in accounts
+        ]
+
+    @server.read_resource()
+    async def read_resource(uri: AnyUrl) -> list[ReadResourceContents]:
+        if str(uri) == METRICS_RESOURCE_URI:
+            return [ReadResourceContents(content=json.dumps(metrics_snapshot(), indent=2),
+                                         mime_type="application/json")]
+
+        account = unread_resource_account(str(uri))
+        async with registry.use(account) as gmail_service:
+            await gmail_service.wait_ready()
+            unread_emails = await gmail_service.get_unread_emails()
+            if isinstance(unread_emails, str):
+                raise ValueError(unread_emails)
+            summaries = await gmail_service.get_email_summaries(
+                [email['id'] for email in unread_emails[:UNREAD_RESOURCE_MAX_MESSAGES]])
+            if isinstance(summaries, str):
+                raise ValueError(summaries)
+        content = {'account': account, 'total': len(unread_emails), 'messages': summaries}
+        return [ReadResourceContents(content=bound_response(content, max_response_bytes),
+                                     mime_type="application/json")]
 
     @server.list_prompts()
     async def list_prompts() -> list[types.Prompt]:
@@ -405,7 +3238,7 @@ async def main(creds_file_path: str, token_path: str):
 
     @server.list_tools()
     async def handle_list_tools() -> list[types.Tool]:
-        return [
+        tools = [
             types.Tool(
                 name="send-email",
                 description="""Sends email to recipient. 
@@ -457,6 +3290,59 @@ async def main(creds_file_path: str, token_path: str):
                     "required": ["recipient_id", "subject", "message", "attachment_path"],
                 },
             ),
+            types.Tool(
+                name="send-bulk-email",
+                description="""Sends a personalised copy of one email to many recipients (mail merge). 
+                Confirm the template and recipient list with the user before sending. 
+                {{field}} placeholders in subject and message are filled from each recipient's fields. 
+                Repeating a call within a week with the same idempotency_key only sends the emails that failed. 
+                Without an idempotency_key, only repeats within an hour are deduplicated. 
+                Emails whose send timed out or is still running are reported pending, repeat the call later to resolve them. 
+                Reports the outcome for each recipient.""",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "subject": {
+                            "type": "string",
+                            "description": "Email subject template",
+                        },
+                        "message": {
+                            "type": "string",
+                            "description": "Email body template",
+                        },
+                        "recipients": {
+                            "type": "array",
+                            "items": {
+                                "anyOf": [
+                                    {"type": "string"},
+                                    {
+                                        "type": "object",
+                                        "properties": {"email": {"type": "string"}},
+                                        "required": ["email"],
+                                    },
+                                ],
+                            },
+                            "maxItems": BULK_SEND_MAX_RECIPIENTS,
+                            "description": "Recipient email addresses, or objects with an email and merge fields",
+                        },
+                        "attachment_path": {
+                            "type": "string",
+                            "description": "Full path to a file attached to every email",
+                        },
+                        "idempotency_key": {
+                            "type": "string",
+                            "description": "Key identifying this mail merge, defaults to one derived from the templates and attachment that expires after an hour",
+                        },
+                        "concurrency": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "maximum": BULK_SEND_MAX_CONCURRENCY,
+                            "description": "Emails sent at the same time",
+                        },
+                    },
+                    "required": ["subject", "message", "recipients"],
+                },
+            ),
             types.Tool(
                 name="trash-email",
                 description="""Moves email to trash. 
@@ -474,16 +3360,35 @@ async def main(creds_file_path: str, token_path: str):
             ),
             types.Tool(
                 name="get-unread-emails",
-                description="Retrieve unread emails",
+                description="""Retrieve unread emails. 
+                Set include_metadata to also get sender, subject, date and snippet for each email, 
+                pages with metadata are shortened to what fits in one response. 
+                Set max_results to get one page at a time, then pass next_page_token back as page_token.""",
                 inputSchema={
                     "type": "object",
-                    "properties": {},
+                    "properties": {
+                        "include_metadata": {
+                            "type": "boolean",
+                            "description": "Include From, Subject, Date and snippet for each email",
+                        },
+                        "max_results": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "maximum": MAX_PAGE_SIZE,
+                            "description": "Page size. Omit to get every unread email at once",
+                        },
+                        "page_token": {
+                            "type": "string",
+                            "description": "next_page_token from the previous page",
+                        },
+                    },
                     "required": []
                 },
             ),
             types.Tool(
                 name="read-email",
-                description="Retrieves given email content",
+                description="""Retrieves given email content. 
+                Use mode 'text' to skip attachment data, or 'headers' for sender, subject and snippet only.""",
                 inputSchema={
                     "type": "object",
                     "properties": {
@@ -491,6 +3396,53 @@ async def main(creds_file_path: str, token_path: str):
                             "type": "string",
                             "description": "Email ID",
                         },
+                        "mode": {
+                            "type": "string",
+                            "enum": READ_MODES,
+                            "description": "What to download: raw (whole message, default), text or headers",
+                        },
+                    },
+                    "required": ["email_id"],
+                },
+            ),
+            types.Tool(
+                name="read-email-body",
+                description="Continues an email body that read-email or read-thread truncated",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "continuation_token": {
+                            "type": "string",
+                            "description": "continuation_token from the truncated response",
+                        },
+                        "max_bytes": {
+                            "type": "integer",
+                            "minimum": min(1024, max_response_bytes),
+                            "maximum": max_response_bytes,
+                            "description": f"Response size limit, at most and by default {max_response_bytes}",
+                        },
+                    },
+                    "required": ["continuation_token"],
+                },
+            ),
+            types.Tool(
+                name="download-attachment",
+                description="Saves an email attachment to disk and returns its local path and size. Get part IDs from read-email in text mode, attachments saved before are not downloaded again",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "email_id": {
+                            "type": "string",
+                            "description": "Email ID",
+                        },
+                        "part_id": {
+                            "type": "string",
+                            "description": "part_id listed by read-email in text mode",
+                        },
+                        "attachment_id": {
+                            "type": "string",
+                            "description": "attachment_id listed by read-email in text mode, saves looking it up when part_id is given",
+                        },
                     },
                     "required": ["email_id"],
                 },
@@ -509,6 +3461,39 @@ async def main(creds_file_path: str, token_path: str):
                     "required": ["email_id"],
                 },
             ),
+            types.Tool(
+                name="mark-emails-as-read",
+                description="""Marks many emails as read in one call. 
+                Reports success or failure for each email ID.""",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "email_ids": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Email IDs",
+                        },
+                    },
+                    "required": ["email_ids"],
+                },
+            ),
+            types.Tool(
+                name="trash-emails",
+                description="""Moves many emails to trash in one call. 
+                Confirm before moving emails to trash. 
+                Reports success or failure for each email ID.""",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "email_ids": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Email IDs",
+                        },
+                    },
+                    "required": ["email_ids"],
+                },
+            ),
             types.Tool(
                 name="open-email",
                 description="Open email in browser",
@@ -523,12 +3508,95 @@ async def main(creds_file_path: str, token_path: str):
                     "required": ["email_id"],
                 },
             ),
+            types.Tool(
+                name="read-thread",
+                description="Retrieves a whole conversation in one request. Quoted reply text is stripped so each message appears once",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "thread_id": {
+                            "type": "string",
+                            "description": "Thread ID, the threadId of any email in the conversation",
+                        },
+                        "mark_as_read": {
+                            "type": "boolean",
+                            "description": "Mark the thread's unread emails as read, defaults to true",
+                        },
+                    },
+                    "required": ["thread_id"],
+                },
+            ),
+            types.Tool(
+                name="search-emails",
+                description="Full-text search over emails already read, ranked best first. Costs no Gmail quota unless remote is set",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "Words to search for. SQLite FTS5 syntax such as \"exact phrase\", OR, prefix* and subject:word is supported",
+                        },
+                        "max_results": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "maximum": MAX_PAGE_SIZE,
+                            "description": "Maximum number of results, defaults to 20",
+                        },
+                        "remote": {
+                            "type": "boolean",
+                            "description": "Also search Gmail when local results are fewer than max_results. The query is passed to Gmail as is",
+                        },
+                    },
+                    "required": ["query"],
+                },
+            ),
         ]
+        for tool in tools:
+            tool.inputSchema["properties"]["account"] = {
+                "type": "string",
+                "enum": list(accounts),
+                "description": f"Mailbox to use, defaults to {default_account}",
+            }
+        return tools
 
     @server.call_tool()
     async def handle_call_tool(
         name: str, arguments: dict | None
     ) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+        account = (arguments or {}).get("account")
+        async with session_limit():
+            return await run_tool(name, arguments, account)
+
+    def session_limit() -> asyncio.Semaphore:
+        """Semaphore capping the tool calls of the session making the current request"""
+        session = server.request_context.session
+        if session not in session_limits:
+            session_limits[session] = asyncio.Semaphore(session_concurrency)
+        return session_limits[session]
+
+    async def run_tool(
+        name: str, arguments: dict | None, account: str | None
+    ) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+        # Checked before timing, so a client cannot add metrics series for made-up names
+        if name not in tool_names:
+            tool_names.update(tool.name for tool in await handle_list_tools())
+            if name not in tool_names:
+                logger.error(f"Unknown tool: {name}")
+                raise ValueError(f"Unknown tool: {name}")
+        with metrics.track_tool(name):
+            async with registry.use(account) as gmail_service:
+                await gmail_service.wait_ready()
+                try:
+                    return await call_gmail_tool(gmail_service, name, arguments)
+                finally:
+                    # The agent is working on this mailbox, so watch it closely for a while
+                    watcher = watchers.get(account or default_account)
+                    if watcher is not None:
+                        watcher.activity()
+
+    async def call_gmail_tool(
+        gmail_service: GmailService, name: str, arguments: dict | None
+    ) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
 
         if name == "send-email":
             recipient = arguments.get("recipient_id")
@@ -550,12 +3618,7 @@ async def main(creds_file_path: str, token_path: str):
                 message_content = message
                 
             send_response = await gmail_service.send_email(recipient, subject, message_content)
-            
-            if send_response["status"] == "success":
-                response_text = f"Email sent successfully. Message ID: {send_response['message_id']}"
-            else:
-                response_text = f"Failed to send email: {send_response['error_message']}"
-            return [types.TextContent(type="text", text=response_text)]
+            return [types.TextContent(type="text", text=json_text(send_response))]
 
         if name == "send-email-with-attachment":
             recipient = arguments.get("recipient_id")
@@ -575,23 +3638,92 @@ async def main(creds_file_path: str, token_path: str):
                 recipient, subject, message, attachment_path
             )
             
+            # The client looks for this wording to tell that its workflow completed
             if send_response["status"] == "success":
-                response_text = '{\n  "content": [\n    {\n      "type": "text",\n      "text": "SUCCESS: Email with attachment sent successfully to ' + recipient + '. Message ID: ' + send_response['message_id'] + '. Workflow completed.",\n      "annotations": null,\n      "_meta": null\n    }\n  ]\n}'
+                send_response["message"] = f"SUCCESS: Email with attachment sent successfully to {recipient}. Workflow completed."
             else:
-                response_text = '{\n  "content": [\n    {\n      "type": "text",\n      "text": "ERROR: Failed to send email with attachment: ' + send_response['error_message'] + '",\n      "annotations": null,\n      "_meta": null\n    }\n  ]\n}'
-            return [types.TextContent(type="text", text=response_text)]
+                send_response["message"] = f"ERROR: Failed to send email with attachment: {send_response['error_message']}"
+            return [types.TextContent(type="text", text=json_text(send_response))]
+
+        if name == "send-bulk-email":
+            subject = arguments.get("subject")
+            if not subject:
+                raise ValueError("Missing subject parameter")
+            message = arguments.get("message")
+            if not message:
+                raise ValueError("Missing message parameter")
+            recipients = arguments.get("recipients")
+            if not recipients:
+                raise ValueError("Missing recipients parameter")
+
+            results = await gmail_service.send_bulk_email(
+                subject, message, recipients, arguments.get("attachment_path"),
+                arguments.get("idempotency_key"), int(arguments.get("concurrency") or BULK_SEND_CONCURRENCY))
+            return [types.TextContent(type="text", text=bound_response(results, max_response_bytes))]
 
         if name == "get-unread-emails":
+            arguments = arguments or {}
+            max_results = arguments.get("max_results")
+            page_token = arguments.get("page_token")
+            # Only fetch metadata for as many emails as the response can hold
+            summary_limit = max(1, max_response_bytes // SUMMARY_RESPONSE_BYTES)
+            if max_results or page_token:
+                max_results = int(max_results or 100)
+                if arguments.get("include_metadata"):
+                    # A smaller page keeps next_page_token pointing at the first email left out
+                    max_results = min(max_results, summary_limit)
+                page = await gmail_service.get_unread_emails_page(max_results, page_token)
+                if arguments.get("include_metadata") and isinstance(page, dict):
+                    page['messages'] = await gmail_service.get_email_summaries(
+                        [email['id'] for email in page['messages']]
+                    )
+                return [types.TextContent(type="text", text=bound_response(page, max_response_bytes))]
+
             unread_emails = await gmail_service.get_unread_emails()
-            return [types.TextContent(type="text", text=str(unread_emails),artifact={"type": "json", "data": unread_emails} )]
+            if arguments.get("include_metadata") and isinstance(unread_emails, list):
+                summaries = await gmail_service.get_email_summaries(
+                    [email['id'] for email in unread_emails[:summary_limit]]
+                )
+                if isinstance(summaries, list) and len(unread_emails) > summary_limit:
+                    summaries = {'results': summaries, 'truncated': True, 'total': len(unread_emails)}
+                unread_emails = summaries
+            return [types.TextContent(type="text", text=bound_response(unread_emails, max_response_bytes))]
         
         if name == "read-email":
             email_id = arguments.get("email_id")
             if not email_id:
                 raise ValueError("Missing email ID parameter")
                 
-            retrieved_email = await gmail_service.read_email(email_id)
-            return [types.TextContent(type="text", text=str(retrieved_email),artifact={"type": "dictionary", "data": retrieved_email} )]
+            mode = arguments.get("mode") or "raw"
+            retrieved_email = await gmail_service.read_email(email_id, mode)
+            if isinstance(retrieved_email, dict) and mode != "headers":
+                retrieved_email = bound_email_bodies([retrieved_email], [email_id], mode, max_response_bytes)[0]
+            return [types.TextContent(type="text", text=bound_response(retrieved_email, max_response_bytes))]
+
+        if name == "download-attachment":
+            email_id = arguments.get("email_id")
+            if not email_id:
+                raise ValueError("Missing email ID parameter")
+            part_id = arguments.get("part_id")
+            attachment_id = arguments.get("attachment_id")
+            if not part_id and not attachment_id:
+                raise ValueError("Missing part ID parameter")
+
+            stored = await gmail_service.download_attachment(email_id, part_id or None, attachment_id or None)
+            return [types.TextContent(type="text", text=bound_response(stored, max_response_bytes))]
+
+        if name == "read-email-body":
+            continuation_token = arguments.get("continuation_token")
+            if not continuation_token:
+                raise ValueError("Missing continuation token parameter")
+
+            email_id, mode, offset = decode_continuation_token(continuation_token)
+            body = await gmail_service.read_email_body(email_id, mode, offset)
+            if isinstance(body, dict):
+                # A larger budget would be cut again below, losing the bytes between the two limits
+                max_bytes = min(int(arguments.get("max_bytes") or max_response_bytes), max_response_bytes)
+                body = bound_email_bodies([body], [email_id], mode, max_bytes)[0]
+            return [types.TextContent(type="text", text=bound_response(body, max_response_bytes))]
         
         if name == "open-email":
             email_id = arguments.get("email_id")
@@ -616,32 +3748,170 @@ async def main(creds_file_path: str, token_path: str):
                 
             msg = await gmail_service.mark_email_as_read(email_id)
             return [types.TextContent(type="text", text=str(msg))]
+
+        if name == "mark-emails-as-read":
+            email_ids = arguments.get("email_ids")
+            if not email_ids:
+                raise ValueError("Missing email IDs parameter")
+
+            results = await gmail_service.mark_emails_as_read(email_ids)
+            return [types.TextContent(type="text", text=bound_response(results, max_response_bytes))]
+
+        if name == "read-thread":
+            thread_id = arguments.get("thread_id")
+            if not thread_id:
+                raise ValueError("Missing thread ID parameter")
+
+            thread = await gmail_service.read_thread(thread_id, arguments.get("mark_as_read", True))
+            if isinstance(thread, dict):
+                thread['messages'] = bound_email_bodies(
+                    thread['messages'], [message['id'] for message in thread['messages']], 'thread',
+                    max_response_bytes - len(json_text({**thread, 'messages': []}).encode()))
+            return [types.TextContent(type="text", text=bound_response(thread, max_response_bytes))]
+
+        if name == "search-emails":
+            query = arguments.get("query")
+            if not query:
+                raise ValueError("Missing query parameter")
+
+            results = await gmail_service.search_emails(
+                query, int(arguments.get("max_results") or 20), bool(arguments.get("remote")))
+            return [types.TextContent(type="text", text=bound_response(results, max_response_bytes))]
+
+        if name == "trash-emails":
+            email_ids = arguments.get("email_ids")
+            if not email_ids:
+                raise ValueError("Missing email IDs parameter")
+
+            results = await gmail_service.trash_emails(email_ids)
+            return [types.TextContent(type="text", text=bound_response(results, max_response_bytes))]
         else:
             logger.error(f"Unknown tool: {name}")
             raise ValueError(f"Unknown tool: {name}")
 
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="gmail",
-                server_version="0.1.0",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
-                ),
-            ),
-        )
+    dump_task = asyncio.create_task(dump_metrics()) if metrics_file else None
+    try:
+        if transport == 'http':
+            await serve_http(server, host, port, shutdown_timeout)
+        else:
+            async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+                logger.info(f"MCP server accepting requests {(time.perf_counter() - PROCESS_START) * 1000:.0f} ms after start")
+                await server.run(
+                    read_stream,
+                    write_stream,
+                    InitializationOptions(
+                        server_name="gmail",
+                        server_version="0.1.0",
+                        capabilities=server.get_capabilities(
+                            notification_options=NotificationOptions(),
+                            experimental_capabilities={},
+                        ),
+                    ),
+                )
+    finally:
+        for watcher in watchers.values():
+            await watcher.close()
+        if dump_task is not None:
+            dump_task.cancel()
+            try:
+                write_metrics_file()
+            except OSError as error:
+                logger.warning(f"Could not write metrics to {metrics_file}: {error}")
+        await registry.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Enhanced Gmail API MCP Server with Attachments')
     parser.add_argument('--creds-file-path',
-                        required=True,
                        help='OAuth 2.0 credentials file path')
     parser.add_argument('--token-path',
-                        required=True,
                        help='File location to store and retrieve access and refresh tokens for application')
+    parser.add_argument('--accounts-file',
+                        default=None,
+                       help='JSON file mapping account names to creds_file_path and token_path, for serving many mailboxes')
+    parser.add_argument('--max-active-accounts',
+                        type=int,
+                        default=MAX_ACTIVE_ACCOUNTS,
+                       help='Accounts kept loaded at once before the least recently used is closed')
+    parser.add_argument('--account-idle-timeout',
+                        type=float,
+                        default=ACCOUNT_IDLE_TIMEOUT,
+                       help='Seconds an account may stay unused before it is closed')
+    parser.add_argument('--cache-path',
+                        default=None,
+                       help='SQLite file for cached messages (defaults to gmail_cache.sqlite3 next to the token file)')
+    parser.add_argument('--max-workers',
+                        type=int,
+                        default=DEFAULT_MAX_WORKERS,
+                       help='Number of threads running Gmail API calls')
+    parser.add_argument('--request-timeout',
+                        type=float,
+                        default=DEFAULT_REQUEST_TIMEOUT,
+                       help='Seconds before a Gmail API call is abandoned')
+    parser.add_argument('--quota-units-per-second',
+                        type=float,
+                        default=GMAIL_QUOTA_UNITS_PER_SECOND,
+                       help='Gmail quota units to spend per second for this user')
     
+    parser.add_argument('--metrics-file',
+                        default=None,
+                       help='Periodically write metrics to this file in Prometheus text format')
+    parser.add_argument('--metrics-interval',
+                        type=float,
+                        default=METRICS_DUMP_INTERVAL,
+                       help='Seconds between metrics file writes')
+    parser.add_argument('--max-response-bytes',
+                        type=int,
+                        default=MAX_RESPONSE_BYTES,
+                       help='Tool responses are cut to this size, longer email bodies continue with read-email-body')
+    parser.add_argument('--body-max-bytes',
+                        type=int,
+                        default=BODY_MAX_BYTES,
+                       help='Email bodies are decoded up to this many bytes, the rest is dropped')
+    parser.add_argument('--attachment-dir',
+                        default=None,
+                       help='Directory for downloaded attachments, defaults to gmail_attachments next to the token file')
+    parser.add_argument('--attachment-cache-bytes',
+                        type=int,
+                        default=ATTACHMENT_CACHE_BYTES,
+                       help='Memory for base64 encoded attachments kept to send again')
+    parser.add_argument('--transport',
+                        choices=['stdio', 'http'],
+                        default='stdio',
+                       help='Serve one client over stdio, or many clients over streamable HTTP')
+    parser.add_argument('--host',
+                        default=HTTP_HOST,
+                       help='Address the HTTP transport listens on')
+    parser.add_argument('--port',
+                        type=int,
+                        default=HTTP_PORT,
+                       help='Port the HTTP transport listens on')
+    parser.add_argument('--session-concurrency',
+                        type=int,
+                        default=SESSION_CONCURRENCY,
+                       help='Tool calls each client session may run at the same time')
+    parser.add_argument('--shutdown-timeout',
+                        type=int,
+                        default=SHUTDOWN_TIMEOUT,
+                       help='Seconds requests in flight may take to finish when the HTTP server stops')
+    parser.add_argument('--prefetch-count',
+                        type=int,
+                        default=PREFETCH_COUNT,
+                       help='After listing unread emails, read this many of the newest in the background (0 disables)')
+    parser.add_argument('--prefetch-bytes',
+                        type=int,
+                        default=PREFETCH_MEMORY_BYTES,
+                       help='Memory for prefetched emails waiting to be read')
+    parser.add_argument('--message-cache-disk-bytes',
+                        type=int,
+                        default=MESSAGE_CACHE_DISK_BYTES,
+                       help='Disk space for raw emails kept in the message cache')
     args = parser.parse_args()
-    asyncio.run(main(args.creds_file_path, args.token_path))
\ No newline at end of file
+    if not args.accounts_file and not (args.creds_file_path and args.token_path):
+        parser.error('--creds-file-path and --token-path are required unless --accounts-file is given')
+    asyncio.run(main(args.creds_file_path, args.token_path, args.cache_path,
+                     args.max_workers, args.request_timeout, args.quota_units_per_second,
+                     args.accounts_file, args.max_active_accounts, args.account_idle_timeout,
+                     args.metrics_file, args.metrics_interval, args.max_response_bytes,
+                     args.body_max_bytes, args.attachment_dir, args.attachment_cache_bytes,
+                     args.transport, args.host, args.port, args.session_concurrency, args.shutdown_timeout,
+                     args.prefetch_count, args.prefetch_bytes, args.message_cache_disk_bytes))
\ No newline at end of file
@@ -0,0 +1,189 @@
+import asyncio
+import base64
+import json
+import quopri
+
+import pytest
+
+from gmail_mcp_server import (GmailService, bound_email_bodies, bound_response, decode_continuation_token,
+                              decode_text, encode_continuation_token, iter_mime_parts, message_body,
+                              strip_quoted_reply, transfer_decode)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Thanks!\n\nOn Mon, Jan 1, 2024 at 10:00 AM Sam <sam@example.com> wrote:\n> hi\n> there', 'Thanks!'),
+    # Attribution wrapped over two lines
+    ('Thanks!\n\nOn Mon, Jan 1, 2024 at 10:00 AM Sam <sam@example.com>\nwrote:\n\n> hi', 'Thanks!'),
+    ('Sure\n-----Original Message-----\nFrom: Sam\nSent: Monday\n\nold text', 'Sure'),
+    ('Sure\n' + '_' * 32 + '\nFrom: Sam\n\nold text', 'Sure'),
+    ('Inline answer\n> question\nmore answer', 'Inline answer\nmore answer'),
+])
+def test_strip_quoted_reply_cuts_quoted_original(text, expected):
+    assert strip_quoted_reply(text) == expected
+
+
+@pytest.mark.parametrize('text', [
+    'On Monday we go\nto the park. Sam wrote:\nx',
+    'Hi team\nOn Friday at 5 we meet. Alex wrote:\nthe agenda',
+    'Meeting moved.\nOn 3 occasions Sam wrote:\n...',
+])
+def test_strip_quoted_reply_keeps_prose_that_reads_like_an_attribution(text):
+    assert strip_quoted_reply(text) == text
+
+
+def test_strip_quoted_reply_keeps_text_that_is_all_quoted():
+    assert strip_quoted_reply('> only quoted\n> more') == '> only quoted\n> more'
+
+
+def build_mime(parts_crlf: bool = False) -> bytes:
+    raw = (
+        b'Subject: nested\n'
+        b'Content-Type: multipart/mixed; boundary="outer"\n'
+        b'\n'
+        b'preamble --outer is not a delimiter here\n'
+        b'--outer\n'
+        b'Content-Type: multipart/alternative; boundary="inner"\n'
+        b'\n'
+        b'--inner\n'
+        b'Content-Type: text/plain; charset=utf-8\n'
+        b'\n'
+        b'plain body\n'
+        b'--inner\n'
+        b'Content-Type: text/html; charset=utf-8\n'
+        b'\n'
+        b'<p>html body</p>\n'
+        b'--inner--\n'
+        b'--outer\n'
+        b'Content-Type: application/octet-stream\n'
+        b'Content-Disposition: attachment; filename="a.bin"\n'
+        b'Content-Transfer-Encoding: base64\n'
+        b'\n'
+        b'AAEC\n'
+        b'--outer--\n'
+    )
+    return raw.replace(b'\n', b'\r\n') if parts_crlf else raw
+
+
+def part_bodies(raw: bytes) -> list[tuple[str, bytes]]:
+    return [(headers.get_content_type(), raw[start:end]) for headers, start, end in iter_mime_parts(raw)]
+
+
+@pytest.mark.parametrize('crlf', [False, True])
+def test_iter_mime_parts_walks_nested_multiparts(crlf):
+    newline = b'\r\n' if crlf else b'\n'
+    assert part_bodies(build_mime(crlf)) == [
+        ('text/plain', b'plain body'),
+        ('text/html', b'<p>html body</p>'),
+        ('application/octet-stream', b'AAEC'),
+    ]
+    assert message_body(build_mime(crlf), 1024) == ('plain body', False)
+    assert newline in build_mime(crlf)
+
+
+def test_iter_mime_parts_runs_an_unterminated_multipart_to_the_end():
+    raw = (b'Content-Type: multipart/mixed; boundary="b"\n\n'
+           b'--b\nContent-Type: text/plain\n\nfirst\n'
+           b'--b\nContent-Type: text/plain\n\nsecond, cut off')
+    assert part_bodies(raw) == [('text/plain', b'first'), ('text/plain', b'second, cut off')]
+
+
+def test_iter_mime_parts_yields_a_single_part_message_whole():
+    raw = b'Content-Type: text/plain\n\nhello\n'
+    assert part_bodies(raw) == [('text/plain', b'hello\n')]
+
+
+def test_message_body_uses_html_when_there_is_no_plain_text():
+    raw = b'Content-Type: text/html\n\n<html><head><style>x{}</style></head><p>Hi</p><p>there</p></html>'
+    assert message_body(raw, 1024) == ('Hi\n\nthere', False)
+
+
+@pytest.mark.parametrize('charset, data, expected', [
+    ('iso-8859-1', 'café'.encode('iso-8859-1'), 'café'),
+    ('x-no-such-charset', 'café'.encode(), 'café'),
+    (None, b'caf\xff', 'caf�'),
+])
+def test_decode_text_falls_back_to_utf8(charset, data, expected):
+    assert decode_text(data, charset) == expected
+
+
+def test_message_body_decodes_the_declared_charset():
+    raw = b'Content-Type: text/plain; charset="x-no-such-charset"\n\ncaf\xc3\xa9'
+    assert message_body(raw, 1024) == ('café', False)
+    raw = b'Content-Type: text/plain; charset=iso-8859-1\nContent-Transfer-Encoding: quoted-printable\n\ncaf=E9'
+    assert message_body(raw, 1024) == ('café', False)
+
+
+@pytest.mark.parametrize('encoding, encode', [
+    ('base64', lambda data: base64.encodebytes(data)),
+    ('quoted-printable', lambda data: quopri.encodestring(data)),
+    ('7bit', lambda data: data),
+])
+def test_transfer_decode_caps_the_output(encoding, encode):
+    data = bytes(range(32, 127)) * 100 if encoding == '7bit' else bytes(range(256)) * 40
+    encoded = encode(data)
+    decoded, cut = transfer_decode(encoded, 0, len(encoded), encoding, 1000)
+    assert (decoded, cut) == (data[:1000], True)
+    decoded, cut = transfer_decode(encoded, 0, len(encoded), encoding, len(data))
+    assert (decoded, cut) == (data, False)
+
+
+def test_message_body_does_not_split_a_character_at_the_cap():
+    raw = b'Content-Type: text/plain; charset=utf-8\n\n' + 'é'.encode() * 10
+    assert message_body(raw, 5) == ('éé', True)
+
+
+def test_continuation_token_round_trip():
+    token = encode_continuation_token('m1', 'text', 1234)
+    assert decode_continuation_token(token) == ('m1', 'text', 1234)
+    with pytest.raises(ValueError, match='Invalid continuation token'):
+        decode_continuation_token(base64.urlsafe_b64encode(b'{"id":"m1"}').decode())
+    with pytest.raises(ValueError, match='Invalid continuation token'):
+        decode_continuation_token('not a token')
+
+
+def test_bound_response_cuts_lists_and_objects():
+    items = [{'id': str(i), 'snippet': 'x' * 50} for i in range(100)]
+    bounded = json.loads(bound_response(items, 1000))
+    assert bounded['truncated'] and bounded['total'] == 100
+    assert bounded['results'] == items[:len(bounded['results'])]
+    assert len(bound_response(items, 1000).encode()) <= 1000
+
+    result = {'messages': items, 'note': 'y' * 5000}
+    text = bound_response(result, 2000)
+    bounded = json.loads(text)
+    assert len(text.encode()) <= 2000
+    assert bounded['truncated'] and bounded['messages_total'] == 100
+    assert bound_response('An HttpError occurred: x' * 100, 10).startswith('An HttpError occurred')
+
+
+def reassemble(content: str, max_bytes: int) -> str:
+    """Follows continuation tokens the way read-email and read-email-body responses are built"""
+    service = GmailService.__new__(GmailService)
+
+    async def read_raw(email_id):
+        return {'content': content}
+
+    service._read_raw = read_raw
+    first = bound_email_bodies([{'id': 'm1', 'content': content}], ['m1'], 'raw', max_bytes)[0]
+    assert len(bound_response(first, max_bytes).encode()) <= max_bytes
+    pieces = [first['content'].encode()]
+    token = first.get('continuation_token')
+    while token:
+        email_id, mode, offset = decode_continuation_token(token)
+        body = asyncio.run(service.read_email_body(email_id, mode, offset))
+        body = bound_email_bodies([body], [email_id], mode, max_bytes)[0]
+        text = bound_response(body, max_bytes)
+        # Anything cut by bound_response after the token was set would be lost
+        assert json.loads(text)['content'] == body['content']
+        pieces.append(body['content'].encode())
+        token = body.get('continuation_token')
+    return b''.join(pieces).decode()
+
+
+@pytest.mark.parametrize('content', [
+    'plain ascii line\n' * 12000,
+    'naïve café — “quotes” and \\ backslashes\t\n' * 5000,
+    '\x01' * 20000,
+])
+def test_continuation_tokens_reassemble_the_whole_body(content):
+    assert reassemble(content, 4096) == content